@@ -3,5 +3,7 @@ from django.conf.urls.defaults import *
 
 urlpatterns = patterns('gaeunit.gaeunit',
     ('/run', 'django_json_test_runner'),
+    ('/list', 'django_json_test_list'),
+    ('/summary', 'django_json_test_summary'),
     ('.*', 'django_test_runner'),
 )
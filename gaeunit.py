@@ -21,6 +21,10 @@ Usage:
 
 4. The results are displayed as the tests are run.
 
+To run the tests without a web server, with the SDK on the Python path, use:
+
+   python gaeunit.py --run [--processes N] [--format plain|json] [test names]
+
 Visit http://code.google.com/p/gaeunit for more information and updates.
 
 ------------------------------------------------------------------------------
@@ -67,17 +71,46 @@ import time
 import logging
 import cgi
 import re
+import heapq
+import hashlib
+import bisect
+import uuid
+import threading
+import types
+import StringIO
+import codecs
+import HTMLParser
+import htmlentitydefs
 import django.utils.simplejson
 
-from xml.sax.saxutils import unescape
+from xml.sax.saxutils import unescape, escape, quoteattr
+try:
+    import cProfile
+    import pstats
+except ImportError:
+    # Not available everywhere, e.g. in the development server's sandbox.
+    cProfile = None
 from google.appengine.ext import webapp
 from google.appengine.api import apiproxy_stub_map  
 from google.appengine.api import datastore_file_stub
 from google.appengine.ext.webapp.util import run_wsgi_app
 
+# unittest leaves the frames of modules that define __unittest out of the
+# tracebacks it reports, as it does its own: those of the timed wrappers of
+# the test methods, and those of the assertions of GAETestCase.
+__unittest = True
+
 _LOCAL_TEST_DIR = 'tests'  # location of files
 _WEB_TEST_DIR = '/test'   # how you want to refer to tests on your web server
 _LOCAL_DJANGO_TEST_DIR = '../../gaeunit/test'
+_SLOWEST_TESTS_COUNT = 10  # default number of tests listed in the plain text timing report, 0 for all
+_LOCAL_STORE_FILE = '.gaeunit.json'  # test run state kept between runs, if files can be written
+_STORE_JOURNAL_GROWTH = 4  # times more journal entries than state entries before the store file is rewritten
+_DEFAULT_TEST_DURATION = 0.1  # estimated seconds for a test without history
+_MAX_RUN_SUMMARIES = 20  # number of runs whose summary /test/summary keeps
+_PROFILE_TOP_FUNCTIONS = 10  # number of functions listed in a test profile
+_API_SERVICES = ['user', 'urlfetch', 'mail', 'memcache', 'images', 'file', 'blobstore']
+_LOOP_QUERY_CALLS = ('datastore_v3.RunQuery', 'datastore_v3.Get')  # checked by assertNoQueriesInLoop
 
 # or:
 # _WEB_TEST_DIR = '/u/test'
@@ -90,7 +123,8 @@ _LOCAL_DJANGO_TEST_DIR = '../../gaeunit/test'
 
 def django_test_runner(request):
     unknown_args = [arg for (arg, v) in request.REQUEST.items()
-                    if arg not in ("format", "package", "name")]
+                    if arg not in ("format", "package", "name", "profile", "slowest") +
+                    _TestSelection.ARGUMENTS]
     if len(unknown_args) > 0:
         errors = []
         for arg in unknown_args:
@@ -101,36 +135,62 @@ def django_test_runner(request):
     format = request.REQUEST.get("format", "html")
     package_name = request.REQUEST.get("package")
     test_name = request.REQUEST.get("name")
+    selection, error = _TestSelection.from_request(request.REQUEST.get)
+    if not error:
+        slowest, error = _slowest_from_request(request.REQUEST.get)
+    if error:
+        from django.http import HttpResponseNotFound
+        return HttpResponseNotFound(error)
     if format == "html":
-        return _render_html(package_name, test_name)
+        return _render_html(package_name, test_name, selection, _flag(request.REQUEST.get("profile")))
     elif format == "plain":
-        return _render_plain(package_name, test_name)
+        return _render_plain(package_name, test_name, selection, slowest)
+    elif format == "junit":
+        return _render_junit(package_name, test_name, selection)
     else:
         error = _log_error("The format '%s' is not valid." % cgi.escape(format))
         from django.http import HttpResponseServerError
         return HttpResponseServerError(error)
 
-def _render_html(package_name, test_name):
-    suite, error = _create_suite(package_name, test_name, _LOCAL_DJANGO_TEST_DIR)
+def _render_html(package_name, test_name, selection, profile):
+    tests_json, error = _list_tests(package_name, test_name, _LOCAL_DJANGO_TEST_DIR, selection, flat=True)
     if not error:
-        content = _MAIN_PAGE_CONTENT % (_test_suite_to_json(suite), _WEB_TEST_DIR, __version__)
+        content = _render_main_page(tests_json, selection, profile)
         from django.http import HttpResponse
         return HttpResponse(content)
     else:
         from django.http import HttpResponseServerError
         return HttpResponseServerError(error)
 
-def _render_plain(package_name, test_name):
+def _render_plain(package_name, test_name, selection, slowest=_SLOWEST_TESTS_COUNT):
     suite, error = _create_suite(package_name, test_name, _LOCAL_DJANGO_TEST_DIR)
     if not error:
+        suite = selection.select_suite(suite)
         from django.http import HttpResponse
         response = HttpResponse()
         response["Content-Type"] = "text/plain"
-        runner = unittest.TextTestRunner(response)
+        runner = _TimedTextTestRunner(response, slowest=slowest)
         response.write("====================\n" \
                         "GAEUnit Test Results\n" \
                         "====================\n\n")
-        _run_test_suite(runner, suite)
+        start_time = time.time()
+        result = _run_test_suite(runner, suite)
+        _record_run(_result_outcomes(result), start_time)
+        return response
+    else:
+        from django.http import HttpResponseServerError
+        return HttpResponseServerError(error)
+
+def _render_junit(package_name, test_name, selection):
+    suite, error = _create_suite(package_name, test_name, _LOCAL_DJANGO_TEST_DIR)
+    if not error:
+        try:
+            from django.http import StreamingHttpResponse as HttpResponse
+        except ImportError:
+            from django.http import HttpResponse
+        # The response sends the parts of the report as they are produced.
+        response = HttpResponse(_junit_report(selection.select_suite(suite)))
+        response["Content-Type"] = "text/xml"
         return response
     else:
         from django.http import HttpResponseServerError
@@ -140,56 +200,191 @@ def django_json_test_runner(request):
     from django.http import HttpResponse
     response = HttpResponse()
     response["Content-Type"] = "text/javascript"
-    test_name = request.REQUEST.get("name")
-    _load_default_test_modules(_LOCAL_DJANGO_TEST_DIR)
-    suite = unittest.defaultTestLoader.loadTestsFromName(test_name)
-    runner = JsonTestRunner()
+    selection, error = _TestSelection.from_request(request.REQUEST.get)
+    if error:
+        from django.http import HttpResponseNotFound
+        return HttpResponseNotFound(error)
+    test_names = _split_test_names(request.REQUEST.getlist("name"),
+                                   request.REQUEST.get("batch"))
+    suite, error = _create_run_suite(test_names, selection, _LOCAL_DJANGO_TEST_DIR)
+    if not error:
+        profiler, error = _profiler_from_request(request.REQUEST.get)
+    if error:
+        from django.http import HttpResponseNotFound
+        return HttpResponseNotFound(error)
+    runner = JsonTestRunner(profiler)
+    start_time = time.time()
     _run_test_suite(runner, suite)
+    _record_run(_result_outcomes(runner.result), start_time)
+    runner.result.modules = _test_module_cache.stats
+    _summarize_run(request.REQUEST.get("run"), runner.result, start_time)
     runner.result.render_to(response)
     return response
 
+def django_json_test_summary(request):
+    from django.http import HttpResponse, HttpResponseNotFound
+    summary, error = _get_run_summary(request.REQUEST.get("run"))
+    if error:
+        return HttpResponseNotFound(error)
+    response = HttpResponse(django.utils.simplejson.dumps(summary))
+    response["Content-Type"] = "text/javascript"
+    return response
+
+def django_json_test_list(request):
+    selection, error = _TestSelection.from_request(request.REQUEST.get)
+    if not error:
+        tests_json, error = _list_tests(request.REQUEST.get("package"), request.REQUEST.get("name"),
+                                        _LOCAL_DJANGO_TEST_DIR, selection)
+    if not error:
+        from django.http import HttpResponse
+        response = HttpResponse(tests_json)
+        response["Content-Type"] = "text/javascript"
+        return response
+    else:
+        from django.http import HttpResponseNotFound
+        return HttpResponseNotFound(error)
+
 ########################################################
 
 class GAETestCase(unittest.TestCase):
     """TestCase parent class that provides the following assert functions
         * assertHtmlEqual - compare two HTML string ignoring the 
             out-of-element blanks and other differences acknowledged in standard.
+        * assertHtmlTreeEqual - compare the elements, attributes and text of
+            two HTML documents, ignoring the order of attributes, <br> vs
+            <br/> and the blanks in text, and optionally some attributes
+            or elements.
+        * assertMaxRPCs - check that the test made at most a number of API
+            calls to a service (e.g. 'datastore_v3') or method (e.g.
+            'datastore_v3.RunQuery') so far.
+        * assertNoQueriesInLoop - check that a function, or the with block
+            if no function is given, does not make a datastore query or get
+            repeatedly from the same place in the code.
+
+    the rpcBudget context manager, which fails the test if the with block
+    makes more calls to a service than its budget, e.g.
+
+        with self.rpcBudget(datastore_v3=3, memcache=1):
+            ...
+
+    and datastore fixtures: define setUpDatastoreFixture to put the entities
+    the tests need.  It is called once per class (or once per module if
+    datastoreFixtureScope is 'module') and the datastore is reset to its
+    entities before each test.  Its return value is available to the tests
+    as self.datastoreFixture.
     """
+
+    setUpDatastoreFixture = None
+    datastoreFixtureScope = 'class'
+    datastoreFixture = None
+
+    def run(self, result=None):
+        stubs = _install_recording_stubs()
+        self._rpcRecording = _rpc_recorder.start()
+        try:
+            if self.setUpDatastoreFixture is not None:
+                try:
+                    self._restoreDatastoreFixture()
+                except Exception:
+                    if result is None:
+                        result = self.defaultTestResult()
+                    result.startTest(self)
+                    result.addError(self, sys.exc_info())
+                    result.stopTest(self)
+                    return result
+                # The fixture's calls are not the test's.
+                self._rpcRecording.clear()
+            return unittest.TestCase.run(self, result)
+        finally:
+            _rpc_recorder.stop()
+            _restore_stubs(stubs)
+
+    def assertMaxRPCs(self, service, count, msg=None):
+        calls = _rpc_count(self._rpcRecording, service)
+        if calls > count:
+            raise self.failureException(msg or "%d %s calls, more than %d: %s" %
+                                        (calls, service, count,
+                                         _describe_rpcs(self._rpcRecording, service)))
+
+    def rpcBudget(self, budgets=None, **services):
+        """Return a context manager that fails the test if its block makes
+        more calls than budgeted to the services (or 'service.method's of
+        budgets).
+        """
+        budgets = dict(budgets or {})
+        budgets.update(services)
+        return _RpcBudget(self, budgets)
+
+    def assertNoQueriesInLoop(self, function=None, *args, **kwargs):
+        check = _QueriesInLoopCheck(self)
+        if function is None:
+            return check
+        check.__enter__()
+        try:
+            result = function(*args, **kwargs)
+        except:
+            check.__exit__(*sys.exc_info())
+            raise
+        check.__exit__(None, None, None)
+        return result
+
+    def _restoreDatastoreFixture(self):
+        stub = apiproxy_stub_map.apiproxy.GetStub('datastore_v3')
+        if stub is None:
+            raise Exception("No datastore stub is registered for the datastore fixture")
+        cls = type(self)
+        if self.datastoreFixtureScope == 'module':
+            key = cls.__module__
+            scope = sys.modules.get(cls.__module__)
+        else:
+            key = '%s.%s' % (cls.__module__, cls.__name__)
+            scope = cls
+        # reload() keeps the module object but defines new classes and
+        # functions, and the module cache gives the module a new version.
+        set_up = getattr(self.setUpDatastoreFixture, 'im_func', self.setUpDatastoreFixture)
+        owner = (scope, _test_module_cache.version(cls.__module__), set_up)
+        fixture = _datastore_fixtures.get(key)
+        if fixture is None or fixture[0] != owner or fixture[2] is None:
+            # First test of the class or module, or its code was reloaded, or
+            # the datastore stub of this SDK cannot copy its entities.
+            # Concurrent runs may both build it; each keeps the entities that
+            # go with its own return value.
+            stub.Clear()
+            value = self.setUpDatastoreFixture()
+            fixture = (owner, value, _get_datastore_state(stub))
+            _datastore_fixtures[key] = fixture
+        else:
+            _set_datastore_state(stub, fixture[2])
+        self.datastoreFixture = fixture[1]
     
     def assertHtmlEqual(self, html1, html2):
         if html1 is None or html2 is None:
             raise self.failureException, "argument is None"
-        html1 = self._formalize(html1)
-        html2 = self._formalize(html2)
-        if not html1 == html2:
-            error_msg = self._findHtmlDifference(html1, html2)
+        normalized1 = _NormalizedHtml(html1)
+        normalized2 = _NormalizedHtml(html2)
+        index = _html_streams_difference(normalized1, normalized2)
+        if index is not None:
+            # The normalized documents are sliced from their parts, not
+            # joined, to show the difference.
+            error_msg = self._findHtmlDifference(normalized1, normalized2, index)
             error_msg = "HTML contents are not equal" + error_msg
+            error_msg += "\nat line %d, column %d of the first HTML and line %d, column %d of the second" % (
+                normalized1.line_and_column(index) + normalized2.line_and_column(index))
             raise self.failureException, error_msg
 
     def _formalize(self, html):
-        html = html.replace("\r\n", " ").replace("\n", " ")
-        html = re.sub(r"[ \t]+", " ", html)
-        html = re.sub(r"[ ]*>[ ]*", ">", html)
-        html = re.sub(r"[ ]*<[ ]*", "<", html)
-        return unescape(html)
+        return _normalize_html(html)
     
-    def _findHtmlDifference(self, html1, html2):
+    def _findHtmlDifference(self, html1, html2, i=None):
         display_window_width = 41
         html1_len = len(html1)
         html2_len = len(html2)
-        for i in range(html1_len):
-            if i >= html2_len or html1[i] != html2[i]:
-                break
-            
-        if html1_len < html2_len:
-            html1 += " " * (html2_len - html1_len)
-            length = html2_len
-        else:
-            html2 += " " * (html1_len - html2_len)
-            length = html1_len
+        if i is None:
+            i = _first_difference(html1, html2)
+        length = max(html1_len, html2_len)
             
         if length <= display_window_width:
-            return "\n%s\n%s\n%s^" % (html1, html2, "_" * i)
+            return "\n%s\n%s\n%s^" % (html1[:length].ljust(length), html2[:length].ljust(length), "_" * i)
         
         start = i - display_window_width / 2
         end = i + 1 + display_window_width / 2
@@ -212,11 +407,411 @@ class GAETestCase(unittest.TestCase):
             pointer_pos = i - start + 3
             leading_dots = "..."
             ending_dots = "..."
-        return '\n%s%s%s\n%s\n%s^' % (leading_dots, html1[start:end], ending_dots, leading_dots+html2[start:end]+ending_dots, "_" * (i - start + len(leading_dots)))
+        # Only the window of the shorter document is padded with blanks.
+        window1 = html1[start:end].ljust(end - start)
+        window2 = html2[start:end].ljust(end - start)
+        return '\n%s%s%s\n%s\n%s^' % (leading_dots, window1, ending_dots, leading_dots+window2+ending_dots, "_" * (i - start + len(leading_dots)))
     
     assertHtmlEquals = assertHtmlEqual
+
+    def assertHtmlTreeEqual(self, html1, html2, ignore_attrs=(), ignore=()):
+        """Fails at the first element, end tag or text that differs between
+        html1 and html2.
+
+        ignore_attrs names attributes not compared on any element.  The
+        elements matched by ignore, each a tag name, '#id', '.class',
+        'tag#id' or 'tag.class', are skipped with their content.
+        """
+        if html1 is None or html2 is None:
+            raise self.failureException, "argument is None"
+        events1 = _HtmlTreeEvents(html1, ignore_attrs, ignore).events()
+        events2 = _HtmlTreeEvents(html2, ignore_attrs, ignore).events()
+        while True:
+            event1 = _next_tree_event(events1, "first", self.failureException)
+            event2 = _next_tree_event(events2, "second", self.failureException)
+            if event1 is None and event2 is None:
+                return
+            if event1 is None or event2 is None or event1[:2] != event2[:2]:
+                raise self.failureException, _describe_tree_difference(event1, event2)
         
       
+##############################################################################
+# HTML comparison
+##############################################################################
+
+_HTML_CHUNK_SIZE = 8192  # characters of HTML normalized at a time by assertHtmlEqual
+_HTML_SPACES = re.compile(" {2,}")
+# Blanks, the entities _normalize_html unescapes and the text between them.
+_HTML_UNITS = re.compile(r"((?:[ \t\n]|\r\n)+)|(&(?:lt|gt|amp);)|[^ \t\n\r&]+|[\s\S]")
+
+
+def _normalize_html(html):
+    """Collapses the blanks of html to one space, removes those next to
+    '<' and '>' and unescapes &lt;, &gt; and &amp;.
+    """
+    # Only plain replaces are needed once the blanks are single spaces.
+    html = html.replace("\r\n", " ").replace("\n", " ").replace("\t", " ")
+    html = _HTML_SPACES.sub(" ", html)
+    html = html.replace(" >", ">").replace("> ", ">").replace(" <", "<").replace("< ", "<")
+    return html.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+
+class _NormalizedHtml(object):
+    """Normalizes html as GAETestCase._formalize does, a part of about
+    _HTML_CHUNK_SIZE characters at a time as it is iterated.
+    """
+
+    def __init__(self, html):
+        self.html = html
+        self.parts = []  # (start, end, normalized text) of the parts so far
+        self._bounds = _html_chunk_bounds(html)
+
+    def __iter__(self):
+        for part in self.parts:
+            yield part[2]
+        for start, end in self._bounds:
+            text = _normalize_html(self.html[start:end])
+            self.parts.append((start, end, text))
+            yield text
+
+    def text(self):
+        return "".join(list(self))
+
+    def __len__(self):
+        return sum([len(text) for text in self])
+
+    def __getitem__(self, key):
+        """Returns a slice of the normalized html, joining only the parts
+        it overlaps.
+        """
+        start, stop, step = key.indices(len(self))
+        texts = []
+        offset = 0
+        for text in self:
+            if offset >= stop:
+                break
+            if offset + len(text) > start:
+                texts.append(text[max(start - offset, 0):stop - offset])
+            offset += len(text)
+        return "".join(texts)
+
+    def line_and_column(self, index):
+        """Returns the line and column in html of the character at index of
+        the normalized html.
+        """
+        for text in self:
+            pass  # normalizes the rest of html
+        return _line_and_column(self.html, _raw_position(self.html, self.parts, index))
+
+def _html_chunk_bounds(html):
+    """Yields the (start, end) of the parts of html that _NormalizedHtml
+    normalizes.
+
+    Each part ends after a '>' and the blanks that follow it, so that it
+    normalizes the same on its own as within the whole document.
+    """
+    start = 0
+    length = len(html)
+    while start < length:
+        end = html.find(">", start + _HTML_CHUNK_SIZE)
+        if end < 0:
+            end = length
+        else:
+            end += 1
+            while end < length:
+                if html[end] in " \t\n":
+                    end += 1
+                elif html.startswith("\r\n", end):
+                    end += 2
+                else:
+                    break
+        yield start, end
+        start = end
+
+def _html_streams_equal(chunks1, chunks2):
+    """Returns whether two iterables of strings have the same concatenation,
+    reading them only up to the first difference.
+    """
+    return _html_streams_difference(chunks1, chunks2) is None
+
+def _html_streams_difference(chunks1, chunks2):
+    """Returns the index of the first character that differs between the
+    concatenations of two iterables of strings, as _first_difference does,
+    or None if they are equal, reading them only up to the first difference.
+    """
+    chunks1 = iter(chunks1)
+    chunks2 = iter(chunks2)
+    text1 = text2 = ""
+    offset = 0
+    while True:
+        if not text1:
+            text1 = _next_chunk(chunks1)
+        if not text2:
+            text2 = _next_chunk(chunks2)
+        if not text1 or not text2:
+            if not text1 and not text2:
+                return None
+            return offset
+        length = min(len(text1), len(text2))
+        if text1[:length] != text2[:length]:
+            return offset + _first_difference(text1[:length], text2[:length])
+        text1 = text1[length:]
+        text2 = text2[length:]
+        offset += length
+
+def _next_chunk(chunks):
+    for chunk in chunks:
+        if chunk:
+            return chunk
+    return ""
+
+
+def _first_difference(text1, text2):
+    """Returns the index of the first character that differs between text1
+    and text2, or the length of the shorter one if it starts the other.
+    """
+    length = min(len(text1), len(text2))
+    start = 0
+    while start < length and \
+            text1[start:start + _HTML_CHUNK_SIZE] == text2[start:start + _HTML_CHUNK_SIZE]:
+        start += _HTML_CHUNK_SIZE
+    # Bisect the part that differs; text1[start:end] differs unless it ends
+    # the shorter text.
+    start = min(start, length)
+    end = min(start + _HTML_CHUNK_SIZE, length)
+    while start < end:
+        middle = (start + end) / 2
+        if text1[start:middle + 1] == text2[start:middle + 1]:
+            start = middle + 1
+        else:
+            end = middle
+    return start
+
+def _raw_position(html, parts, index):
+    """Returns the position in html of the character at index of the
+    normalized html, given the (start, end, normalized text) of its parts.
+    """
+    for start, end, text in parts:
+        if index < len(text):
+            break
+        index -= len(text)
+    else:
+        return len(html)
+    # Walk the part as _normalize_html changes it: a run of blanks becomes
+    # one space, or nothing next to a '<' or '>', and an entity one character.
+    for unit in _HTML_UNITS.finditer(html, start, end):
+        if unit.group(1):
+            if (unit.start() > start and html[unit.start() - 1] in "<>") or \
+                    (unit.end() < end and html[unit.end()] in "<>"):
+                continue
+            size = 1
+        elif unit.group(2):
+            size = 1
+        else:
+            size = unit.end() - unit.start()
+        if index < size:
+            return unit.start() + index
+        index -= size
+    return end
+
+def _line_and_column(html, position):
+    """Returns the line and column, both counted from 1, of position in html."""
+    line_start = html.rfind("\n", 0, position) + 1
+    return html.count("\n", 0, position) + 1, position - line_start + 1
+
+
+# Elements without content or end tag.
+_VOID_ELEMENTS = frozenset(['area', 'base', 'br', 'col', 'command', 'embed', 'hr', 'img', 'input',
+                            'keygen', 'link', 'meta', 'param', 'source', 'track', 'wbr'])
+# The open elements a start tag ends, if they are the innermost ones.
+_IMPLIED_END_TAGS = {'li': ('li',), 'dt': ('dt', 'dd'), 'dd': ('dt', 'dd'), 'option': ('option',),
+                     'p': ('p',), 'tr': ('tr', 'td', 'th'), 'td': ('td', 'th'), 'th': ('td', 'th')}
+_HTML_BLANKS = re.compile(u"[ \t\n\r\f]+")
+
+
+class _HtmlTreeEvents(HTMLParser.HTMLParser):
+    """Parses html _HTML_CHUNK_SIZE characters at a time into the events
+    assertHtmlTreeEqual compares: ('start', (tag, attributes)), ('end', tag),
+    ('text', text) and ('declaration', text), each followed by the path of
+    its node and its line and column.
+
+    Only the open elements and the events of one part of html are kept, so
+    memory grows with the depth of the document, not its size.
+    """
+
+    def __init__(self, html, ignore_attrs, ignore):
+        HTMLParser.HTMLParser.__init__(self)
+        self.html = html
+        self.ignore_attrs = frozenset(ignore_attrs)
+        self.ignore = [_parse_selector(selector) for selector in ignore]
+        self.pending = []
+        self.text = []
+        self.text_position = None
+        # (tag, path, count of the children by tag, ignored) of the open elements
+        self.open = [(None, "", {}, False)]
+
+    def events(self):
+        """Yields the events of html, ending with the end of its open elements."""
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        for start in range(0, len(self.html), _HTML_CHUNK_SIZE):
+            part = self.html[start:start + _HTML_CHUNK_SIZE]
+            if isinstance(part, str):
+                part = decoder.decode(part)
+            self.feed(part)
+            for event in self._take_pending():
+                yield event
+        self.feed(decoder.decode("", True))
+        self.close()
+        self._flush_text()
+        while len(self.open) > 1:
+            self._end_element()
+        for event in self._take_pending():
+            yield event
+
+    def _take_pending(self):
+        pending = self.pending
+        self.pending = []
+        return pending
+
+    def _add(self, kind, value, path, position=None):
+        line, offset = position or self.getpos()
+        self.pending.append((kind, value, path, line, offset + 1))
+
+    def _flush_text(self):
+        if self.text:
+            text = _HTML_BLANKS.sub(u" ", u"".join(self.text)).strip(u" ")
+            if text:
+                self._add("text", text, self.open[-1][1], self.text_position)
+            self.text = []
+
+    def _end_element(self):
+        tag, path, children, ignored = self.open[-1]
+        if not ignored:
+            self._flush_text()
+            self._add("end", tag, path)
+        self.open.pop()
+
+    def handle_starttag(self, tag, attrs):
+        # Ignored elements, and the elements in them, are kept open like
+        # the others, so that they end the same way, but have no events.
+        while self.open[-1][0] in _IMPLIED_END_TAGS.get(tag, ()):
+            self._end_element()
+        parent_tag, path, children, ignored = self.open[-1]
+        if ignored or _matches_selectors(tag, attrs, self.ignore):
+            if tag not in _VOID_ELEMENTS:
+                self.open.append((tag, path, {}, True))
+            return
+        self._flush_text()
+        children[tag] = children.get(tag, 0) + 1
+        if path:
+            path += "/"
+        path += tag
+        if children[tag] > 1:
+            path += "[%d]" % children[tag]
+        attrs = [(name, value) for (name, value) in attrs if name not in self.ignore_attrs]
+        attrs.sort()
+        self._add("start", (tag, attrs), path)
+        if tag not in _VOID_ELEMENTS:
+            self.open.append((tag, path, {}, False))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        # Elements left open inside this one end with it; end tags of
+        # elements that are not open are ignored.
+        tags = [open_tag for (open_tag, path, children, ignored) in self.open]
+        if tag in tags:
+            for i in range(tags[::-1].index(tag) + 1):
+                self._end_element()
+
+    def handle_data(self, data):
+        if not self.open[-1][3]:
+            if not self.text:
+                self.text_position = self.getpos()
+            self.text.append(data)
+
+    def handle_charref(self, name):
+        try:
+            if name[:1] in ("x", "X"):
+                character = unichr(int(name[1:], 16))
+            else:
+                character = unichr(int(name))
+        except (ValueError, OverflowError):
+            character = u"&#%s;" % name
+        self.handle_data(character)
+
+    def handle_entityref(self, name):
+        if name in htmlentitydefs.name2codepoint:
+            self.handle_data(unichr(htmlentitydefs.name2codepoint[name]))
+        else:
+            self.handle_data(u"&%s;" % name)
+
+    def handle_decl(self, decl):
+        if not self.open[-1][3]:
+            self._flush_text()
+            self._add("declaration", _HTML_BLANKS.sub(u" ", decl).lower(), "")
+
+def _parse_selector(selector):
+    """Returns the (tag, id, class) of a selector of assertHtmlTreeEqual's
+    ignore argument, each None if the selector does not give it.
+    """
+    match = re.match(r"^([\w-]*)(?:#([\w-]+)|\.([\w-]+))?$", selector)
+    if not match or not any(match.groups()):
+        raise ValueError("The selector '%s' is not valid." % selector)
+    tag, id, class_name = match.groups()
+    return tag.lower() or None, id, class_name
+
+def _matches_selectors(tag, attrs, selectors):
+    for selector_tag, selector_id, selector_class in selectors:
+        if selector_tag and selector_tag != tag:
+            continue
+        attributes = dict(attrs)
+        if selector_id and attributes.get("id") != selector_id:
+            continue
+        if selector_class and selector_class not in (attributes.get("class") or "").split():
+            continue
+        return True
+    return False
+
+def _next_tree_event(events, which, failureException):
+    try:
+        return events.next()
+    except StopIteration:
+        return None
+    except HTMLParser.HTMLParseError, e:
+        raise failureException, "The %s HTML cannot be parsed: %s" % (which, e)
+
+def _describe_tree_event(event):
+    if event is None:
+        return "the end of the document"
+    kind, value, path, line, column = event
+    if kind == "start":
+        tag, attrs = value
+        attributes = []
+        for name, value in attrs:
+            if value is None:
+                attributes.append(" %s" % name)
+            else:
+                attributes.append(' %s="%s"' % (name, value))
+        description = "<%s%s>" % (tag, "".join(attributes))
+    elif kind == "end":
+        description = "</%s>" % value
+    elif kind == "text":
+        description = "text %r" % (len(value) > 40 and value[:40] + u"..." or value)
+    else:
+        description = "<!%s>" % value
+    return "%s at line %d, column %d" % (description, line, column)
+
+def _describe_tree_difference(event1, event2):
+    # The path of an element that is missing in the other document is
+    # longer than that of the end of its parent there.
+    path = max([event[2] for event in (event1, event2) if event], key=len)
+    return "HTML trees are not equal at %s\nfirst:  %s\nsecond: %s" % (
+        path or "the document", _describe_tree_event(event1), _describe_tree_event(event2))
+
+
 ##############################################################################
 # Main request handler
 ##############################################################################
@@ -225,7 +820,8 @@ class GAETestCase(unittest.TestCase):
 class MainTestPageHandler(webapp.RequestHandler):
     def get(self):
         unknown_args = [arg for arg in self.request.arguments()
-                        if arg not in ("format", "package", "name")]
+                        if arg not in ("format", "package", "name", "profile", "slowest") +
+                        _TestSelection.ARGUMENTS]
         if len(unknown_args) > 0:
             errors = []
             for arg in unknown_args:
@@ -237,37 +833,462 @@ class MainTestPageHandler(webapp.RequestHandler):
         format = self.request.get("format", "html")
         package_name = self.request.get("package")
         test_name = self.request.get("name")
-        if format == "html":
-            self._render_html(package_name, test_name)
+        selection, error = _TestSelection.from_request(self.request.get)
+        if not error:
+            slowest, error = _slowest_from_request(self.request.get)
+        if error:
+            self.error(404)
+            self.response.out.write(error)
+        elif format == "html":
+            self._render_html(package_name, test_name, selection, _flag(self.request.get("profile")))
         elif format == "plain":
-            self._render_plain(package_name, test_name)
+            self._render_plain(package_name, test_name, selection, slowest)
+        elif format == "junit":
+            self._render_junit(package_name, test_name, selection)
         else:
             error = _log_error("The format '%s' is not valid." % cgi.escape(format))
             self.error(404)
             self.response.out.write(error)
             
-    def _render_html(self, package_name, test_name):
-        suite, error = _create_suite(package_name, test_name, _LOCAL_TEST_DIR)
+    def _render_html(self, package_name, test_name, selection, profile):
+        tests_json, error = _list_tests(package_name, test_name, _LOCAL_TEST_DIR, selection, flat=True)
         if not error:
-            self.response.out.write(_MAIN_PAGE_CONTENT % (_test_suite_to_json(suite), _WEB_TEST_DIR, __version__))
+            self.response.out.write(_render_main_page(tests_json, selection, profile))
         else:
             self.error(404)
             self.response.out.write(error)
         
-    def _render_plain(self, package_name, test_name):
+    def _render_plain(self, package_name, test_name, selection, slowest):
         self.response.headers["Content-Type"] = "text/plain"
-        runner = unittest.TextTestRunner(self.response.out)
+        runner = _TimedTextTestRunner(self.response.out, slowest=slowest)
         suite, error = _create_suite(package_name, test_name, _LOCAL_TEST_DIR)
         if not error:
+            suite = selection.select_suite(suite)
             self.response.out.write("====================\n" \
                                     "GAEUnit Test Results\n" \
                                     "====================\n\n")
-            _run_test_suite(runner, suite)
+            start_time = time.time()
+            result = _run_test_suite(runner, suite)
+            _record_run(_result_outcomes(result), start_time)
+        else:
+            self.error(404)
+            self.response.out.write(error)
+
+    def _render_junit(self, package_name, test_name, selection):
+        suite, error = _create_suite(package_name, test_name, _LOCAL_TEST_DIR)
+        if not error:
+            self.response.headers["Content-Type"] = "text/xml"
+            # webapp buffers the response, so it holds the whole report
+            # until the request ends.
+            for part in _junit_report(selection.select_suite(suite)):
+                self.response.out.write(part)
         else:
             self.error(404)
             self.response.out.write(error)
 
 
+##############################################################################
+# Test timing
+##############################################################################
+
+
+class _TestTimer(object):
+    """Measures the wall-clock time of each test and of its setUp, test
+    method and tearDown phases.
+
+    The phases are timed by shadowing the methods with timed wrappers on the
+    test instance between start() and stop().
+    """
+
+    def __init__(self):
+        self.timings = []
+        self._current = None
+        self._patched = []
+
+    def start(self, test):
+        timing = {'name': test.id(), 'time': 0.0,
+                  'setUp': 0.0, 'test': 0.0, 'tearDown': 0.0}
+        method_name = getattr(test, '_testMethodName', None)
+        self._patched = []
+        for phase, attr in (('setUp', 'setUp'), ('test', method_name),
+                            ('tearDown', 'tearDown')):
+            method = attr and getattr(test, attr, None)
+            if method is None:
+                continue
+            self._patched.append((attr, test.__dict__.get(attr, _MISSING)))
+            setattr(test, attr, _timed_call(method, timing, phase))
+        self._current = timing
+        _rpc_recorder.start()
+        timing['start'] = time.time()
+
+    def stop(self, test):
+        timing = self._current
+        timing['time'] = time.time() - timing.pop('start')
+        timing['rpcs'] = _rpc_recorder.stop()
+        for attr, original in self._patched:
+            if original is _MISSING:
+                del test.__dict__[attr]
+            else:
+                test.__dict__[attr] = original
+        self._patched = []
+        self._current = None
+        self.timings.append(timing)
+        return timing
+
+    def slowest(self, count):
+        return _slowest(self.timings, count)
+
+
+_MISSING = object()
+
+
+def _slowest(timings, count):
+    """Return the count slowest timings, slowest first, or all if count is 0."""
+    timings = sorted(timings, key=lambda timing: timing['time'], reverse=True)
+    return timings[:count or None]
+
+
+def _write_slowest_tests(stream, timings):
+    if not timings:
+        return
+    stream.write("\nSlowest %d tests:\n" % len(timings))
+    for timing in timings:
+        stream.write("%8.3fs  %s (setUp %.3fs, test %.3fs, tearDown %.3fs)\n" %
+                     (timing['time'], timing['name'], timing['setUp'],
+                      timing['test'], timing['tearDown']))
+        _write_rpcs(stream, timing.get('rpcs'))
+
+
+def _timed_call(method, timing, phase):
+    def timed(*args, **kwargs):
+        start = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timing[phase] += time.time() - start
+    # Keep attributes such as the unittest skip markers visible.
+    timed.__dict__.update(getattr(method, '__dict__', {}))
+    return timed
+
+
+class _TestProfiler(object):
+    """Profiles each test with cProfile and keeps its hotspots: the functions
+    with the most time spent in them, with (cumulative) and without (self)
+    the functions they called.
+
+    The profile of each test is also saved as a .pstats file in dump_dir,
+    if given.
+    """
+
+    def __init__(self, top=_PROFILE_TOP_FUNCTIONS, dump_dir=None):
+        self.top = top
+        self.dump_dir = dump_dir
+        self._profile = None
+
+    def start(self, test):
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self, test):
+        profile = self._profile
+        profile.disable()
+        self._profile = None
+        if self.dump_dir:
+            if not os.path.isdir(self.dump_dir):
+                os.makedirs(self.dump_dir)
+            profile.dump_stats(os.path.join(self.dump_dir, test.id() + '.pstats'))
+        return _hotspots(pstats.Stats(profile).stats, self.top)
+
+
+def _hotspots(stats, count):
+    """Return the count functions of pstats stats with the most cumulative and
+    the most self time, leaving out gaeunit's own functions.
+    """
+    own_file = os.path.splitext(_source_file(sys.modules[__name__]))[0]
+    base = os.path.abspath(os.curdir) + os.sep
+    functions = []
+    for (filename, line, name), (primitive_calls, calls, self_time, cumulative_time, callers) \
+            in stats.items():
+        if (os.path.splitext(os.path.abspath(filename))[0] == own_file or
+                name.startswith("<method 'disable' of")):
+            continue
+        if filename.startswith(base):
+            filename = filename[len(base):]
+        functions.append({'function': '%s:%d(%s)' % (filename, line, name), 'calls': calls,
+                          'self': self_time, 'cumulative': cumulative_time})
+    hotspots = {}
+    for key in ('cumulative', 'self'):
+        functions.sort(key=lambda function: function[key], reverse=True)
+        hotspots[key] = functions[:count]
+    return hotspots
+
+
+def _write_profiles(stream, timings):
+    for timing in timings:
+        if not timing.get('profile'):
+            continue
+        stream.write("\nProfile of %s (%.3fs):\n" % (timing['name'], timing['time']))
+        for key in ('cumulative', 'self'):
+            stream.write("  by %s time:\n" % key)
+            for function in timing['profile'][key]:
+                stream.write("%10.3fs %8d  %s\n" % (function[key], function['calls'],
+                                                   function['function']))
+
+
+class _TimedTextTestResult(unittest._TextTestResult):
+    def __init__(self, stream, descriptions, verbosity):
+        unittest._TextTestResult.__init__(self, stream, descriptions, verbosity)
+        self.timer = _TestTimer()
+
+    def startTest(self, test):
+        unittest._TextTestResult.startTest(self, test)
+        self.timer.start(test)
+
+    def stopTest(self, test):
+        self.timer.stop(test)
+        unittest._TextTestResult.stopTest(self, test)
+        _reset_test_datastore()
+
+
+class _TimedTextTestRunner(unittest.TextTestRunner):
+    """TextTestRunner that ends its report with the times and API calls of
+    the slowest tests, of all tests if slowest is 0.
+    """
+
+    def __init__(self, stream=sys.stderr, descriptions=1, verbosity=1,
+                 slowest=_SLOWEST_TESTS_COUNT):
+        unittest.TextTestRunner.__init__(self, stream, descriptions, verbosity)
+        self.slowest = slowest
+
+    def _makeResult(self):
+        return _TimedTextTestResult(self.stream, self.descriptions, self.verbosity)
+
+    def run(self, test):
+        result = unittest.TextTestRunner.run(self, test)
+        _write_slowest_tests(self.stream, result.timer.slowest(self.slowest))
+        return result
+
+
+##############################################################################
+# API call recording
+##############################################################################
+
+
+class _RpcRecorder(object):
+    """Counts the API calls made between start() and stop(), and the time
+    spent in them, per service and method (e.g. 'datastore_v3.Put').
+
+    Recordings nest: a call counts in every recording of its thread that has
+    started and not stopped yet.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _thread_state(self):
+        local = self._local
+        if not hasattr(local, 'recordings'):
+            local.recordings = []
+            local.call_sites = []
+        return local
+
+    def start(self):
+        """Start a recording and return it; it is filled in until stop()."""
+        recording = {}
+        self._thread_state().recordings.append(recording)
+        return recording
+
+    def stop(self):
+        return self._thread_state().recordings.pop()
+
+    def start_call_sites(self):
+        """Also count the calls per call site until stop_call_sites(): the
+        stack of the application code that made them.  Finding the call site
+        makes calls slower, so it is only done while asked for.
+        """
+        call_sites = {}
+        self._thread_state().call_sites.append(call_sites)
+        return call_sites
+
+    def stop_call_sites(self):
+        return self._thread_state().call_sites.pop()
+
+    def record(self, service, call, duration):
+        key = '%s.%s' % (service, call)
+        state = self._thread_state()
+        for recording in state.recordings:
+            entry = recording.get(key)
+            if entry is None:
+                entry = recording[key] = {'calls': 0, 'time': 0.0}
+            entry['calls'] += 1
+            entry['time'] += duration
+        if state.call_sites:
+            site = (key, _call_site())
+            for call_sites in state.call_sites:
+                call_sites[site] = call_sites.get(site, 0) + 1
+
+
+def _call_site():
+    """Return the (file, line, function) of the frames of the application
+    code on the stack, innermost first, leaving out gaeunit and the SDK.
+    """
+    own_file = os.path.splitext(_source_file(sys.modules[__name__]))[0]
+    sdk = os.sep + os.path.join('google', 'appengine') + os.sep
+    site = []
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.abspath(code.co_filename)
+        if os.path.splitext(filename)[0] != own_file and sdk not in filename:
+            site.append((code.co_filename, frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    return tuple(site)
+
+
+_rpc_recorder = _RpcRecorder()
+
+
+class _RecordingStub(object):
+    """Wraps an API stub to record its calls; any other attribute is the
+    wrapped stub's.
+
+    Its rpc_recorder attribute is public: code that makes API calls in
+    threads of its own, such as webtest's TestApp.load(), can find the
+    recorder through the stubs of the test apiproxy and record the calls of
+    each thread with its start() and stop().
+    """
+
+    def __init__(self, stub, recorder):
+        if isinstance(stub, _RecordingStub):
+            stub = stub._stub
+        self.__dict__['_stub'] = stub
+        self.__dict__['rpc_recorder'] = recorder
+
+    def MakeSyncCall(self, service, call, request, response):
+        start = time.time()
+        try:
+            return self._stub.MakeSyncCall(service, call, request, response)
+        finally:
+            self.rpc_recorder.record(service, call, time.time() - start)
+
+    def CreateRPC(self):
+        # Asynchronous calls are made through the stub of the RPC.
+        rpc = self._stub.CreateRPC()
+        rpc.stub = self
+        return rpc
+
+    def __getattr__(self, name):
+        return getattr(self._stub, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._stub, name, value)
+
+
+def _install_recording_stubs():
+    """Wrap the stubs of the current apiproxy that do not record their calls
+    yet, and return what _restore_stubs needs to unwrap them.
+    """
+    apiproxy = apiproxy_stub_map.apiproxy
+    wrapped = []
+    for name in ['datastore', 'datastore_v3'] + _API_SERVICES:
+        stub = apiproxy.GetStub(name)
+        if stub is not None and not isinstance(stub, _RecordingStub):
+            apiproxy.RegisterStub(name, _RecordingStub(stub, _rpc_recorder))
+            wrapped.append((name, stub))
+    return apiproxy, wrapped
+
+
+def _restore_stubs(state):
+    apiproxy, wrapped = state
+    for name, stub in wrapped:
+        apiproxy.RegisterStub(name, stub)
+
+
+def _rpc_count(recording, service):
+    """Return the number of calls of a recording to a service, or to a single
+    method if service is 'service.method'.
+    """
+    count = 0
+    for key, entry in recording.items():
+        if key == service or key.startswith(service + '.'):
+            count += entry['calls']
+    return count
+
+
+def _describe_rpcs(recording, service):
+    return ", ".join(["%s x%d" % (key, entry['calls']) for key, entry in sorted(recording.items())
+                      if key == service or key.startswith(service + '.')])
+
+
+class _RpcBudget(object):
+    """Context manager that fails the test if the code of the with block
+    makes more API calls than budgeted.
+    """
+
+    def __init__(self, test, budgets, msg=None):
+        self.test = test
+        self.budgets = budgets
+        self.msg = msg
+
+    def __enter__(self):
+        self._recording = _rpc_recorder.start()
+        return self._recording
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _rpc_recorder.stop()
+        if exc_type is not None:
+            return False
+        for service, budget in sorted(self.budgets.items()):
+            count = _rpc_count(self._recording, service)
+            if count > budget:
+                raise self.test.failureException(self.msg or
+                    "%d %s calls, more than the budget of %d: %s" %
+                    (count, service, budget, _describe_rpcs(self._recording, service)))
+        return False
+
+
+class _QueriesInLoopCheck(object):
+    """Context manager that fails the test if the code of the with block
+    makes a datastore query or get more than once from the same call site,
+    which is the N+1 pattern of a query in a loop.
+    """
+
+    def __init__(self, test, msg=None):
+        self.test = test
+        self.msg = msg
+
+    def __enter__(self):
+        self._call_sites = _rpc_recorder.start_call_sites()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _rpc_recorder.stop_call_sites()
+        if exc_type is not None:
+            return False
+        repeated = [(count, key, site) for (key, site), count in self._call_sites.items()
+                    if count > 1 and key in _LOOP_QUERY_CALLS]
+        if repeated:
+            repeated.sort()
+            count, key, site = repeated[-1]
+            if site:
+                filename, line, function = site[0]
+                where = "%s:%d (in %s)" % (filename, line, function)
+            else:
+                where = "an unknown call site"
+            raise self.test.failureException(self.msg or
+                "%s was called %d times from %s, probably in a loop" % (key, count, where))
+        return False
+
+
+def _write_rpcs(stream, rpcs):
+    if not rpcs:
+        return
+    for key, entry in sorted(rpcs.items(), key=lambda item: -item[1]['time']):
+        stream.write("%20s%-32s %5d call%s %8.3fs\n" % ("", key, entry['calls'],
+                                                       entry['calls'] != 1 and "s" or " ",
+                                                       entry['time']))
+
+
 ##############################################################################
 # JSON test classes
 ##############################################################################
@@ -277,16 +1298,55 @@ class JsonTestResult(unittest.TestResult):
     def __init__(self):
         unittest.TestResult.__init__(self)
         self.testNumber = 0
+        self.modules = None
+        self.summary = None
+        self.tests = []
+        self.timeTaken = 0.0
+        self.timer = _TestTimer()
+        self.profiler = None
+
+    def startTest(self, test):
+        unittest.TestResult.startTest(self, test)
+        self._counts = (len(self.errors), len(self.failures))
+        self.timer.start(test)
+        if self.profiler:
+            self.profiler.start(test)
+
+    def stopTest(self, test):
+        profile = self.profiler and self.profiler.stop(test)
+        timing = self.timer.stop(test)
+        unittest.TestResult.stopTest(self, test)
+        _reset_test_datastore()
+        errors, failures = self._counts
+        if len(self.errors) > errors:
+            status = 'error'
+        elif len(self.failures) > failures:
+            status = 'failure'
+        else:
+            status = 'success'
+        record = dict(timing)
+        record['status'] = status
+        if profile:
+            record['profile'] = profile
+        self.tests.append(record)
 
     def render_to(self, stream):
+        stream.write(django.utils.simplejson.dumps(self.as_dict()).replace('},', '},\n'))
+
+    def as_dict(self):
         result = {
             'runs': self.testsRun,
             'total': self.testNumber,
+            'time': self.timeTaken,
             'errors': self._list(self.errors),
             'failures': self._list(self.failures),
+            'tests': self.tests,
             }
-
-        stream.write(django.utils.simplejson.dumps(result).replace('},', '},\n'))
+        if self.modules is not None:
+            result['modules'] = self.modules
+        if self.summary is not None:
+            result['summary'] = self.summary
+        return result
 
     def _list(self, list):
         dict = []
@@ -300,39 +1360,328 @@ class JsonTestResult(unittest.TestResult):
 
 
 class JsonTestRunner:
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+
     def run(self, test):
         self.result = JsonTestResult()
+        self.result.profiler = self.profiler
         self.result.testNumber = test.countTestCases()
         startTime = time.time()
         test(self.result)
         stopTime = time.time()
-        timeTaken = stopTime - startTime
+        self.result.timeTaken = stopTime - startTime
         return self.result
 
 
 class JsonTestRunHandler(webapp.RequestHandler):
+    """Runs the tests given by every 'name' parameter and by the comma
+    separated 'batch' parameter in a single request.
+    """
+
     def get(self):    
         self.response.headers["Content-Type"] = "text/javascript"
-        test_name = self.request.get("name")
-        _load_default_test_modules(_LOCAL_TEST_DIR)
-        suite = unittest.defaultTestLoader.loadTestsFromName(test_name)
-        runner = JsonTestRunner()
+        selection, error = _TestSelection.from_request(self.request.get)
+        if not error:
+            test_names = _split_test_names(self.request.get_all("name"),
+                                           self.request.get("batch"))
+            suite, error = _create_run_suite(test_names, selection, _LOCAL_TEST_DIR)
+        if not error:
+            profiler, error = _profiler_from_request(self.request.get)
+        if error:
+            self.error(404)
+            self.response.out.write(error)
+            return
+        runner = JsonTestRunner(profiler)
+        start_time = time.time()
         _run_test_suite(runner, suite)
+        _record_run(_result_outcomes(runner.result), start_time)
+        runner.result.modules = _test_module_cache.stats
+        _summarize_run(self.request.get("run"), runner.result, start_time)
         runner.result.render_to(self.response.out)
 
 
+class JsonTestSummaryHandler(webapp.RequestHandler):
+    """Returns the totals, test duration percentiles and failures of the
+    /test/run requests with the same 'run' parameter, as JSON.
+    """
+
+    def get(self):
+        self.response.headers["Content-Type"] = "text/javascript"
+        summary, error = _get_run_summary(self.request.get("run"))
+        if not error:
+            self.response.out.write(django.utils.simplejson.dumps(summary))
+        else:
+            self.error(404)
+            self.response.out.write(error)
+
+
 # This is not used by the HTML page, but it may be useful for other client test runners.
 class JsonTestListHandler(webapp.RequestHandler):
     def get(self):
         self.response.headers["Content-Type"] = "text/javascript"
-        suite, error = _create_suite(self.request) #TODO
+        selection, error = _TestSelection.from_request(self.request.get)
         if not error:
-            self.response.out.write(_test_suite_to_json(suite))
+            tests_json, error = _list_tests(self.request.get("package"), self.request.get("name"),
+                                            _LOCAL_TEST_DIR, selection)
+        if not error:
+            self.response.out.write(tests_json)
         else:
             self.error(404)
             self.response.out.write(error)
 
 
+##############################################################################
+# JUnit XML
+##############################################################################
+
+
+_JUNIT_HEADER = '<?xml version="1.0" encoding="utf-8"?>\n<testsuites>\n<testsuite name="gaeunit">\n'
+_JUNIT_FOOTER = '</testsuite>\n</testsuites>\n'
+_XML_INVALID_CHARACTERS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class _JUnitTestResult(unittest.TestResult):
+    """Writes a JUnit XML <testcase> element to the stream as each test
+    finishes.
+
+    Unlike other test results it does not keep the errors and failures, so
+    its memory does not grow with their tracebacks.
+    """
+
+    def __init__(self, stream):
+        unittest.TestResult.__init__(self)
+        self.stream = stream
+        self.timer = _TestTimer()
+        self.outcomes = []
+        self.errorCount = 0
+        self.failureCount = 0
+        self._current = None
+
+    def startTest(self, test):
+        unittest.TestResult.startTest(self, test)
+        self._current = test
+        self._outcome = ('success', None)
+        self.timer.start(test)
+
+    def stopTest(self, test):
+        timing = self.timer.stop(test)
+        del self.timer.timings[:]
+        unittest.TestResult.stopTest(self, test)
+        _reset_test_datastore()
+        self._current = None
+        self._write_testcase(test, timing['time'], *self._outcome)
+        status = self._outcome[0]
+        if status == 'skipped':
+            status = 'success'
+        self.outcomes.append((timing['name'], status, timing['time']))
+
+    def addError(self, test, err):
+        self._add_outcome(test, 'error', err)
+
+    def addFailure(self, test, err):
+        self._add_outcome(test, 'failure', err)
+
+    def addSkip(self, test, reason):
+        self._add_outcome(test, 'skipped', reason)
+
+    def addExpectedFailure(self, test, err):
+        pass
+
+    def addUnexpectedSuccess(self, test):
+        pass
+
+    def wasSuccessful(self):
+        return self.errorCount == 0 and self.failureCount == 0
+
+    def _add_outcome(self, test, status, detail):
+        if status == 'error':
+            self.errorCount += 1
+        elif status == 'failure':
+            self.failureCount += 1
+        if test is self._current:
+            self._outcome = (status, detail)
+        else:
+            # An error outside of a test, such as in setUpClass.
+            self._write_testcase(test, 0.0, status, detail)
+
+    def _write_testcase(self, test, duration, status, detail):
+        test_id = test.id()
+        if isinstance(test, unittest.TestCase):
+            class_name, name = test_id.rsplit('.', 1)
+        else:
+            class_name, name = '', test_id
+        self.stream.write('<testcase classname=%s name=%s time="%.3f"' %
+                          (_xml_attribute(class_name), _xml_attribute(name), duration))
+        if status == 'success':
+            self.stream.write('/>\n')
+            return
+        self.stream.write('>\n')
+        if status == 'skipped':
+            self.stream.write('<skipped message=%s/>\n' % _xml_attribute(detail))
+        else:
+            exc_type, exc_value, tb = detail
+            message = str(exc_value).split('\n', 1)[0]
+            self.stream.write('<%s type=%s message=%s>%s</%s>\n' %
+                              (status, _xml_attribute(exc_type.__name__), _xml_attribute(message),
+                               _xml_text(self._exc_info_to_string(detail, test)), status))
+        self.stream.write('</testcase>\n')
+
+
+def _xml_text(value):
+    return escape(_xml_characters(value))
+
+
+def _xml_attribute(value):
+    return quoteattr(_xml_characters(value))
+
+
+def _xml_characters(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return _XML_INVALID_CHARACTERS.sub('?', value)
+
+
+def _junit_report(suite):
+    """Run the test suite and yield its JUnit XML report in parts, one part
+    per test, so that it can be sent while the tests run.
+    """
+    tests = []
+    _get_tests_from_suite(suite, tests)
+    stream = StringIO.StringIO()
+    result = _JUnitTestResult(stream)
+    yield _JUNIT_HEADER
+    start_time = time.time()
+    state = _install_test_apiproxy()
+    try:
+        # Run the tests one at a time as parts of a single run, so that the
+        # class and module fixtures of Python 2.7 are still set up once.
+        result._testRunEntered = True
+        for test in tests:
+            if result.shouldStop:
+                break
+            unittest.TestSuite([test]).run(result)
+            yield _drain(stream)
+        result._testRunEntered = False
+        unittest.TestSuite().run(result)
+    finally:
+        _restore_apiproxy(state)
+    _record_run(result.outcomes, start_time)
+    yield _drain(stream) + _JUNIT_FOOTER
+
+
+def _drain(stream):
+    value = stream.getvalue()
+    stream.seek(0)
+    stream.truncate()
+    return value
+
+
+##############################################################################
+# Test datastore
+##############################################################################
+
+
+class _DatastoreStubPool(object):
+    """Pool of in-memory datastore stubs shared by the test runs of a process.
+
+    Stubs are created once and cleared each time they are acquired, which is
+    much cheaper than constructing a new DatastoreFileStub for every run.
+    Concurrent runs each get a stub of their own.  A snapshot saves the
+    entities of a stub under a name so that any stub of the pool can be reset
+    to them later.  Snapshots copy the entities of the DatastoreFileStub of
+    the SDKs that keep them in the attributes of _DATASTORE_STATE_ATTRIBUTES;
+    with other SDKs snapshot() returns False and the entities have to be put
+    again.
+    """
+
+    def __init__(self):
+        self._free = []
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, snapshot=None):
+        self._lock.acquire()
+        try:
+            if self._free:
+                stub = self._free.pop()
+            else:
+                stub = None
+        finally:
+            self._lock.release()
+        if stub is None:
+            stub = datastore_file_stub.DatastoreFileStub('GAEUnitDataStore', None, None, trusted=True)
+        else:
+            stub.Clear()
+        if snapshot is not None:
+            self.restore(stub, snapshot)
+        return stub
+
+    def release(self, stub):
+        self._lock.acquire()
+        try:
+            self._free.append(stub)
+        finally:
+            self._lock.release()
+
+    def snapshot(self, stub, name):
+        """Save the entities of stub as snapshot name and return True, or
+        return False if they cannot be copied.
+        """
+        state = _get_datastore_state(stub)
+        if state is None:
+            return False
+        self._snapshots[name] = state
+        return True
+
+    def restore(self, stub, name):
+        _set_datastore_state(stub, self._snapshots[name])
+
+
+_datastore_pool = _DatastoreStubPool()
+
+# Datastore fixtures of GAETestCase by class or module name: (owner, return
+# value of setUpDatastoreFixture, entities it created or None).
+_datastore_fixtures = {}
+
+# The private attributes of DatastoreFileStub that hold its entities.
+_DATASTORE_STATE_ATTRIBUTES = ('_DatastoreFileStub__entities',
+                               '_DatastoreFileStub__next_id',
+                               '_DatastoreFileStub__schema_cache')
+
+
+def _get_datastore_state(stub):
+    """Return a copy of the entities of a datastore stub, or None if the
+    stub does not keep them where this SDK's DatastoreFileStub does.
+
+    Stored entities are replaced rather than modified by a put, so copying
+    the entity dictionaries is enough to isolate the copy from later changes.
+    """
+    if not hasattr(stub, _DATASTORE_STATE_ATTRIBUTES[0]):
+        return None
+    state = {}
+    for name in _DATASTORE_STATE_ATTRIBUTES:
+        if hasattr(stub, name):
+            state[name] = _copy_datastore_value(getattr(stub, name))
+    return state
+
+
+def _set_datastore_state(stub, state):
+    for name, value in state.items():
+        setattr(stub, name, _copy_datastore_value(value))
+
+
+def _copy_datastore_value(value):
+    if not isinstance(value, dict):
+        return value
+    copy = {}
+    for key, item in value.items():
+        if isinstance(item, dict):
+            item = dict(item)
+        copy[key] = item
+    return copy
+
+
 ##############################################################################
 # Module helper functions
 ##############################################################################
@@ -369,11 +1718,260 @@ def _create_suite(package_name, test_name, test_dir):
     return (suite, error)
 
 
+class _TestModuleCache(object):
+    """Imports the modules of a test directory.
+
+    A module is only reloaded when the modification time or size of its
+    file has changed since it was last loaded, so repeated test runs do not
+    pay for re-importing the whole test directory.  The counts of the last
+    load are kept in 'stats'.
+
+    """
+
+    def __init__(self):
+        self._stamps = {}
+        self._versions = {}
+        self._dependencies = {}
+        self.stats = {'imported': 0, 'reloaded': 0, 'cached': 0}
+        # Concurrent requests must not import or reload a module at once.
+        self._lock = threading.RLock()
+
+    def version(self, name):
+        """Return a number that changes whenever the module is (re)loaded."""
+        return self._versions.get(name, 0)
+
+    def dependencies(self, name):
+        """Return the source files of the module and of the application
+        modules it imported, directly or indirectly, when it was loaded.
+        """
+        return self._dependencies.get(name)
+
+    def load(self, test_dir):
+        self._lock.acquire()
+        try:
+            return self._load(test_dir)
+        finally:
+            self._lock.release()
+
+    def _load(self, test_dir):
+        if not test_dir in sys.path:
+            sys.path.append(test_dir)
+        stats = {'imported': 0, 'reloaded': 0, 'cached': 0}
+        modules = []
+        for file_name in os.listdir(test_dir):
+            if not file_name.endswith(".py"):
+                continue
+            name = file_name[0:-3]
+            path = os.path.join(test_dir, file_name)
+            file_stat = os.stat(path)
+            stamp = (file_stat.st_mtime, file_stat.st_size)
+            module = sys.modules.get(name)
+            if module is None:
+                module = __import__(name)
+                stats['imported'] += 1
+            elif self._stamps.get(path) != stamp:
+                module = reload(module)
+                stats['reloaded'] += 1
+            else:
+                stats['cached'] += 1
+                modules.append(module)
+                continue
+            self._versions[name] = self.version(name) + 1
+            self._dependencies[name] = _module_dependencies(module, os.path.abspath(os.curdir))
+            self._stamps[path] = stamp
+            modules.append(module)
+        self.stats = stats
+        return modules
+
+
+_test_module_cache = _TestModuleCache()
+
+
+def _module_dependencies(module, app_dir):
+    """Return the source files of a module and of the modules under app_dir
+    that it refers to, directly or indirectly.
+    """
+    files = []
+    seen = {}
+    pending = [module]
+    while pending:
+        current = pending.pop()
+        if current.__name__ in seen:
+            continue
+        seen[current.__name__] = True
+        path = _source_file(current)
+        if path is None or (current is not module and not path.startswith(app_dir + os.sep)):
+            continue
+        files.append(path)
+        for value in vars(current).values():
+            if isinstance(value, types.ModuleType):
+                pending.append(value)
+                continue
+            try:
+                module_name = getattr(value, '__module__', None)
+            except Exception:
+                continue
+            if isinstance(module_name, str) and sys.modules.get(module_name) is not None:
+                pending.append(sys.modules[module_name])
+    files.sort()
+    return files
+
+
+def _source_file(module):
+    path = getattr(module, '__file__', None)
+    if not path:
+        return None
+    if path.endswith('.pyc') or path.endswith('.pyo'):
+        path = path[:-1]
+    return os.path.abspath(path)
+
+
 def _load_default_test_modules(test_dir):
-    if not test_dir in sys.path:
-        sys.path.append(test_dir)
-    module_names = [mf[0:-3] for mf in os.listdir(test_dir) if mf.endswith(".py")]
-    return [reload(__import__(name)) for name in module_names]
+    return _test_module_cache.load(test_dir)
+
+
+class _TestIndex(object):
+    """Index of the tests in a test directory: module -> class -> methods.
+
+    The tests of a module are only listed again after the module cache has
+    reloaded it, and the JSON of the whole index is kept until any module
+    changes.
+    """
+
+    def __init__(self, module_cache):
+        self._module_cache = module_cache
+        self._entries = {}
+        self._json = {}
+
+    def tests(self, test_dir):
+        return self._tests(self._module_cache.load(test_dir))
+
+    def to_json(self, test_dir, flat=False):
+        """Return the JSON of the index, or of its sorted test ids if flat."""
+        modules = self._module_cache.load(test_dir)
+        key = [(module.__name__, self._module_cache.version(module.__name__)) for module in modules]
+        key.sort()
+        cached_key, tests_json = self._json.get(flat, (None, None))
+        if key != cached_key:
+            tests = self._tests(modules)
+            if flat:
+                tests = _test_dict_to_ids(tests)
+            tests_json = django.utils.simplejson.dumps(tests)
+            self._json[flat] = (key, tests_json)
+        return tests_json
+
+    def _tests(self, modules):
+        test_dict = {}
+        for module in modules:
+            _merge_test_dicts(test_dict, self._entry(module)[1])
+        return test_dict
+
+    def _entry(self, module):
+        version = self._module_cache.version(module.__name__)
+        entry = self._entries.get(module.__name__)
+        if entry is None or entry[0] != version:
+            suite = unittest.defaultTestLoader.loadTestsFromModule(module)
+            entry = (version, _test_suite_to_dict(suite))
+            self._entries[module.__name__] = entry
+        return entry
+
+
+_test_index = _TestIndex(_test_module_cache)
+
+
+def _merge_test_dicts(test_dict, other):
+    for module_name, classes in other.items():
+        mod_dict = test_dict.setdefault(module_name, {})
+        for class_name, methods in classes.items():
+            mod_dict.setdefault(class_name, []).extend(methods)
+
+
+def _list_tests(package_name, test_name, test_dir, selection=None, flat=False):
+    """Return the JSON of the tests to run and an error message, if any.
+
+    The tests are listed as module -> class -> methods (see
+    _test_suite_to_json), or as a list of test ids in the order to run them
+    if flat.  The whole test directory is listed from the index.
+    """
+    if package_name or test_name:
+        suite, error = _create_suite(package_name, test_name, test_dir)
+        if error:
+            return None, error
+        tests = []
+        _get_tests_from_suite(suite, tests)
+        test_ids = [test.id() for test in tests]
+    else:
+        try:
+            if selection is None or not selection.is_active():
+                tests_json = _test_index.to_json(test_dir, flat)
+            else:
+                tests_json = None
+                test_ids = _test_dict_to_ids(_test_index.tests(test_dir))
+        except Exception, e:
+            return None, _log_error(str(e))
+        if tests_json in ('{}', '[]') or (tests_json is None and not test_ids):
+            return None, _log_error("'local directory: \"%s\"' is not found or does not contain any tests." % test_dir)
+        if tests_json is not None:
+            return tests_json, None
+    if selection is not None:
+        test_ids = selection.select(test_ids)
+    if flat:
+        return django.utils.simplejson.dumps(test_ids), None
+    return django.utils.simplejson.dumps(_test_ids_to_dict(test_ids)), None
+
+
+def _profiler_from_request(get):
+    """Return the profiler of a 'profile=1' request, or None, and an error
+    message, if any.
+    """
+    if not _flag(get("profile")):
+        return None, None
+    if cProfile is None:
+        return None, _log_error("The cProfile module needed by 'profile' is not available.")
+    return _TestProfiler(), None
+
+
+def _slowest_from_request(get):
+    """Return the number of tests of the plain text timing report of a
+    request, and an error message, if any.
+    """
+    slowest = get("slowest")
+    if not slowest:
+        return _SLOWEST_TESTS_COUNT, None
+    try:
+        slowest = int(slowest)
+    except ValueError:
+        slowest = -1
+    if slowest < 0:
+        return None, _log_error("The 'slowest' parameter must be a number of tests, or 0 for all.")
+    return slowest, None
+
+
+def _create_run_suite(test_names, selection, test_dir):
+    """Return the suite of a /test/run request and an error message, if any:
+    the named tests, or all tests if sharded without names, of the shard.
+    """
+    if not test_names and selection.shards <= 1:
+        return None, _log_error("No tests to run: give 'name' or 'batch' parameters, "
+                                "or 'shard' and 'shards' to run a shard of all tests.")
+    if not test_names:
+        suite, error = _create_suite(None, None, test_dir)
+        if error:
+            return None, error
+    else:
+        _load_default_test_modules(test_dir)
+        suite = unittest.defaultTestLoader.loadTestsFromNames(test_names)
+    return selection.select_shard_suite(suite), None
+
+
+def _split_test_names(names, batch):
+    """Return the test names of a run request: the given names followed by
+    the comma separated names of 'batch'.
+    """
+    test_names = [name for name in names if name]
+    if batch:
+        test_names.extend([name.strip() for name in batch.split(",") if name.strip()])
+    return test_names
 
 
 def _get_tests_from_suite(suite, tests):
@@ -385,6 +1983,10 @@ def _get_tests_from_suite(suite, tests):
 
 
 def _test_suite_to_json(suite):
+    return django.utils.simplejson.dumps(_test_suite_to_dict(suite))
+
+
+def _test_suite_to_dict(suite):
     tests = []
     _get_tests_from_suite(suite, tests)
     test_tuples = [(type(test).__module__, type(test).__name__, test._testMethodName) \
@@ -408,36 +2010,656 @@ def _test_suite_to_json(suite):
                 method_list = mod_dict[class_name]
                 method_list.append(method_name)
                 
-    return django.utils.simplejson.dumps(test_dict)
+    return test_dict
 
 
 def _run_test_suite(runner, suite):
     """Run the test suite.
 
     Preserve the current development apiproxy, create a new apiproxy and
-    replace the datastore with a temporary one that will be used for this
-    test suite, run the test suite, and restore the development apiproxy.
-    This isolates the test datastore from the development datastore.
+    replace the datastore with an empty in-memory one from the stub pool
+    that will be used for this test suite, run the test suite, and restore
+    the development apiproxy.  This isolates the test datastore from the
+    development datastore.  The datastore is emptied again after each test.
 
     """        
-    original_apiproxy = apiproxy_stub_map.apiproxy
+    state = _install_test_apiproxy()
     try:
-       apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap() 
-       temp_stub = datastore_file_stub.DatastoreFileStub('GAEUnitDataStore', None, None, trusted=True)  
-       apiproxy_stub_map.apiproxy.RegisterStub('datastore', temp_stub)
-       # Allow the other services to be used as-is for tests.
-       for name in ['user', 'urlfetch', 'mail', 'memcache', 'images', 'file', 'blobstore']:
-           apiproxy_stub_map.apiproxy.RegisterStub(name, original_apiproxy.GetStub(name))
-       runner.run(suite)
+       return runner.run(suite)
     finally:
-       apiproxy_stub_map.apiproxy = original_apiproxy
+       _restore_apiproxy(state)
+
+
+def _install_test_apiproxy():
+    """Install the apiproxy of a test run for the current thread and return
+    what _restore_apiproxy needs to restore the previous one.
+
+    While runs are in progress apiproxy_stub_map.apiproxy is a
+    _ThreadLocalAPIProxy, so that concurrent runs in other threads keep
+    their own apiproxy.  The apiproxy it replaced is put back when the last
+    run ends.
+    """
+    _test_apiproxy_lock.acquire()
+    try:
+        thread_apiproxy = _test_apiproxy_runs.get('apiproxy')
+        if thread_apiproxy is None:
+            _test_apiproxy_runs['original'] = apiproxy_stub_map.apiproxy
+            thread_apiproxy = _ThreadLocalAPIProxy(apiproxy_stub_map.apiproxy)
+            _test_apiproxy_runs['apiproxy'] = thread_apiproxy
+        _test_apiproxy_runs['count'] = _test_apiproxy_runs.get('count', 0) + 1
+        apiproxy_stub_map.apiproxy = thread_apiproxy
+    finally:
+        _test_apiproxy_lock.release()
+    original_apiproxy = thread_apiproxy.current()
+    temp_stub = _datastore_pool.acquire()
+    previous_stub = getattr(_test_datastores, 'stub', None)
+    _test_datastores.stub = temp_stub
+    test_apiproxy = apiproxy_stub_map.APIProxyStubMap() 
+    test_apiproxy.RegisterStub('datastore', _RecordingStub(temp_stub, _rpc_recorder))
+    test_apiproxy.RegisterStub('datastore_v3', _RecordingStub(temp_stub, _rpc_recorder))
+    # Allow the other services to be used as-is for tests.
+    for name in _API_SERVICES:
+        stub = original_apiproxy.GetStub(name)
+        if stub is not None:
+            stub = _RecordingStub(stub, _rpc_recorder)
+        test_apiproxy.RegisterStub(name, stub)
+    previous = thread_apiproxy.set_current(test_apiproxy)
+    return thread_apiproxy, previous, temp_stub, previous_stub
+
+
+def _restore_apiproxy(state):
+    thread_apiproxy, previous, temp_stub, previous_stub = state
+    thread_apiproxy.set_current(previous)
+    _test_datastores.stub = previous_stub
+    _datastore_pool.release(temp_stub)
+    _test_apiproxy_lock.acquire()
+    try:
+        _test_apiproxy_runs['count'] -= 1
+        if not _test_apiproxy_runs['count']:
+            apiproxy_stub_map.apiproxy = _test_apiproxy_runs.pop('original')
+            del _test_apiproxy_runs['apiproxy']
+    finally:
+        _test_apiproxy_lock.release()
+
+
+# The number of test runs in progress, the _ThreadLocalAPIProxy they use
+# and the apiproxy it replaced.
+_test_apiproxy_runs = {}
+_test_apiproxy_lock = threading.Lock()
+
+# The datastore stub of the test run of each thread.
+_test_datastores = threading.local()
+
+
+def _reset_test_datastore():
+    """Empty the datastore of the test run of the current thread, so that
+    the next test starts with an empty datastore like the first one.
+
+    The test results call it when a test stops; a GAETestCase fixture is put
+    back when the next test starts.
+    """
+    stub = getattr(_test_datastores, 'stub', None)
+    if stub is not None:
+        stub.Clear()
+
+
+class _ThreadLocalAPIProxy(object):
+    """Stands in for apiproxy_stub_map.apiproxy: each thread uses the
+    apiproxy of its test run, or the default (development) apiproxy when it
+    is not running tests.
+    """
+
+    def __init__(self, default):
+        self.__dict__['default'] = default
+        self.__dict__['_local'] = threading.local()
+
+    def current(self):
+        apiproxy = getattr(self._local, 'apiproxy', None)
+        if apiproxy is None:
+            return self.default
+        return apiproxy
+
+    def set_current(self, apiproxy):
+        """Use apiproxy in this thread (the default if None) and return the
+        one it used before.
+        """
+        previous = getattr(self._local, 'apiproxy', None)
+        self._local.apiproxy = apiproxy
+        return previous
+
+    def __getattr__(self, name):
+        return getattr(self.current(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.current(), name, value)
+
+
+def _render_main_page(tests_json, selection, profile=False):
+    durations, default = _duration_history()
+    schedule = {'durations': durations, 'default': default,
+                'ordered': selection.order is not None}
+    return _MAIN_PAGE_CONTENT % (tests_json, django.utils.simplejson.dumps(schedule),
+                                 django.utils.simplejson.dumps(_run_summaries.new_run_id()),
+                                 django.utils.simplejson.dumps(bool(profile)),
+                                 _WEB_TEST_DIR, _WEB_TEST_DIR, __version__)
+
+
+def _get_run_summary(run_id):
+    """Return the summary of a run and an error message, if any."""
+    if not run_id:
+        return None, _log_error("The 'run' parameter is required.")
+    summary = _run_summaries.get(run_id)
+    if summary is None:
+        return None, _log_error("The run '%s' is not known." % cgi.escape(run_id))
+    return summary, None
 
 
 def _log_error(s):
    logging.warn(s)
    return s
 
-           
+
+##############################################################################
+# Test selection
+##############################################################################
+
+
+def _application_file(path):
+    """Return the absolute path of a path relative to the application
+    directory (the current directory), or None if it is not in it.
+    """
+    if os.path.isabs(path):
+        return None
+    root = os.path.realpath(os.getcwd())
+    full_path = os.path.realpath(os.path.join(root, path))
+    if not full_path.startswith(os.path.join(root, '')):
+        return None
+    return full_path
+
+
+class _TestSelection(object):
+    """The request options that select and order the tests of a run:
+
+        changed: if '1', only the tests whose module, or an application
+            module it imports, has changed since the test last passed.
+        rerun: if 'failed', only the tests that failed when they last ran.
+        order: if 'failed-first', the tests that failed when they last ran
+            come first.
+        shard, shards: only the tests of partition 'shard' (counted from 0)
+            of 'shards' partitions, so that several servers or processes
+            can each run a part of the same tests.
+        shard_by: if 'hash', the partitions have the same number of tests,
+            each test assigned by a stable hash of its id; if 'duration',
+            the same estimated duration, from the run history file given
+            by 'history'.  Each shard is selected by its own server or
+            process, so the partitions only agree when all of them read the
+            same history; without a history file they are by hash.
+        history: the run history file (a .gaeunit.json written by the
+            command line runner) of 'duration' shards.  A request can only
+            name a file of the application directory, relative to it.
+    """
+
+    ARGUMENTS = ("changed", "rerun", "order", "shard", "shards", "shard_by", "history")
+
+    def __init__(self, changed=False, rerun=None, order=None, shard=0, shards=1,
+                 shard_by='hash', history=None):
+        self.changed = changed
+        self.rerun = rerun
+        self.order = order
+        self.shard = shard
+        self.shards = shards
+        self.shard_by = shard_by
+        self.history = history
+
+    def from_request(cls, get):
+        """Return the selection of the request arguments and an error
+        message, if any.
+        """
+        shard, shards = get("shard"), get("shards")
+        if not shard and not shards:
+            shard, shards = 0, 1
+        else:
+            try:
+                shard, shards = int(shard), int(shards)
+            except (TypeError, ValueError):
+                return None, _log_error("The 'shard' and 'shards' parameters must both be numbers.")
+        history = get("history") or None
+        if history is not None:
+            history = _application_file(history)
+            if history is None:
+                return None, _log_error("The 'history' parameter must name a file of the "
+                                        "application directory, relative to it.")
+        return cls.create(changed=_flag(get("changed")), rerun=get("rerun") or None,
+                          order=get("order") or None, shard=shard, shards=shards,
+                          shard_by=get("shard_by") or 'hash', history=history)
+    from_request = classmethod(from_request)
+
+    def create(cls, **options):
+        """Return the selection of the options and an error message, if any."""
+        selection = cls(**options)
+        if not 0 <= selection.shard < selection.shards:
+            return None, _log_error("The shard %d of %d shards is not valid." %
+                                    (selection.shard, selection.shards))
+        if selection.shard_by not in ('hash', 'duration'):
+            return None, _log_error("The shard_by '%s' is not valid." % cgi.escape(selection.shard_by))
+        if selection.history is not None and not os.path.isfile(selection.history):
+            return None, _log_error("The history file '%s' does not exist." % cgi.escape(selection.history))
+        if selection.shard_by == 'duration' and selection.history is None and selection.shards > 1:
+            logging.warning("Shards by duration need a history file; sharding by hash.")
+        return selection, None
+    create = classmethod(create)
+
+    def is_active(self):
+        return bool(self.changed or self.rerun == 'failed' or self.order == 'failed-first' or
+                    self.shards > 1)
+
+    def select_shard(self, test_ids):
+        """Return the tests of this shard, in the given order.
+
+        The partitions only depend on the given tests (and, for 'duration',
+        on the history file), so every shard must be given the same tests.
+        """
+        if self.shards <= 1:
+            return test_ids
+        if self.shard_by == 'duration' and self.history is not None:
+            history = _LocalStore(self.history).data().get('history', {})
+            workers, loads = _schedule_longest_first(sorted(test_ids),
+                                                     _estimate_durations(test_ids, history),
+                                                     self.shards)
+            workers.extend([[]] * (self.shards - len(workers)))
+            shard = dict.fromkeys(workers[self.shard])
+        else:
+            shard = dict.fromkeys(sorted(test_ids, key=_stable_hash)[self.shard::self.shards])
+        return [test_id for test_id in test_ids if test_id in shard]
+
+    def select(self, test_ids):
+        test_ids = self.select_shard(test_ids)
+        if self.changed:
+            is_changed = _change_tracker.selector()
+            test_ids = [test_id for test_id in test_ids if is_changed(test_id)]
+        if self.rerun == 'failed':
+            failed = _run_history.failed()
+            test_ids = [test_id for test_id in test_ids if test_id in failed]
+        if self.order == 'failed-first':
+            failed = _run_history.failed()
+            test_ids = ([test_id for test_id in test_ids if test_id in failed] +
+                        [test_id for test_id in test_ids if test_id not in failed])
+        return test_ids
+
+    def select_suite(self, suite):
+        if not self.is_active():
+            return suite
+        return _select_from_suite(suite, self.select)
+
+    def select_shard_suite(self, suite):
+        if self.shards <= 1:
+            return suite
+        return _select_from_suite(suite, self.select_shard)
+
+
+def _select_from_suite(suite, select):
+    tests = []
+    _get_tests_from_suite(suite, tests)
+    tests_by_id = dict([(test.id(), test) for test in tests])
+    return unittest.TestSuite([tests_by_id[test_id] for test_id in
+                               select([test.id() for test in tests])])
+
+
+def _flag(value):
+    return value not in (None, '', '0', 'false')
+
+
+def _stable_hash(test_id):
+    """Hash of a test id that is the same in every process and Python version."""
+    return hashlib.md5(test_id).hexdigest(), test_id
+
+
+def _test_dict_to_ids(test_dict):
+    test_ids = []
+    for module_name, classes in test_dict.items():
+        for class_name, methods in classes.items():
+            for method_name in methods:
+                test_ids.append('%s.%s.%s' % (module_name, class_name, method_name))
+    test_ids.sort()
+    return test_ids
+
+
+def _test_ids_to_dict(test_ids):
+    test_dict = {}
+    for test_id in test_ids:
+        module_name, class_name, method_name = test_id.rsplit('.', 2)
+        test_dict.setdefault(module_name, {}).setdefault(class_name, []).append(method_name)
+    return test_dict
+
+
+class _LocalStore(object):
+    """Small JSON document of named sections (dictionaries) that keeps test
+    run state between runs.
+
+    It is saved to a file when files can be written (the command line
+    runner), and only lives as long as the process in the development web
+    server, which does not allow writing files.  The file is a journal: a
+    save appends a line with only the entries set or removed (null) since
+    the last save, and the file is rewritten with the whole document once
+    the journal holds many more entries than the document.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._changes = {}
+        self._journal_path = None
+        self._journal_entries = 0
+        self._writable = True
+
+    def data(self):
+        if self._data is None:
+            self._data = {}
+            self._journal_path = self.path
+            try:
+                f = open(self.path)
+                try:
+                    content = f.read()
+                finally:
+                    f.close()
+            except (IOError, OSError):
+                return self._data
+            if not content.endswith('\n'):
+                # A file of an older version, or a save that did not finish.
+                self._journal_path = None
+            for line in content.splitlines():
+                if not line:
+                    continue
+                try:
+                    change = django.utils.simplejson.loads(line)
+                except ValueError:
+                    self._journal_path = None
+                    continue
+                self._apply(change)
+                self._journal_entries += _count_entries(change)
+        return self._data
+
+    def move(self, path):
+        """Keep the state in the file at path from now on."""
+        self.path = path
+        self._data = None
+        self._changes = {}
+        self._journal_entries = 0
+
+    def section(self, name):
+        return self.data().setdefault(name, {})
+
+    def set(self, name, key, value):
+        self.section(name)[key] = value
+        self._changes.setdefault(name, {})[key] = value
+
+    def remove(self, name, key):
+        if self.section(name).pop(key, _MISSING) is not _MISSING:
+            self._changes.setdefault(name, {})[key] = None
+
+    def _apply(self, change):
+        for name, entries in change.items():
+            section = self._data.setdefault(name, {})
+            for key, value in entries.items():
+                if value is None:
+                    section.pop(key, None)
+                else:
+                    section[key] = value
+
+    def save(self):
+        changes, self._changes = self._changes, {}
+        if not self._writable or not changes:
+            return
+        data = self.data()
+        journal_entries = self._journal_entries + _count_entries(changes)
+        rewrite = (self._journal_path != self.path or
+                   journal_entries > _STORE_JOURNAL_GROWTH * max(_count_entries(data), 1))
+        try:
+            if rewrite:
+                f = open(self.path, 'w')
+                changes = data
+                journal_entries = _count_entries(data)
+            else:
+                f = open(self.path, 'a')
+            try:
+                f.write(django.utils.simplejson.dumps(changes) + '\n')
+            finally:
+                f.close()
+        except (IOError, OSError), e:
+            self._writable = False
+            _log_error("Test run state is kept in memory only: %s" % e)
+            return
+        self._journal_path = self.path
+        self._journal_entries = journal_entries
+
+
+def _count_entries(sections):
+    return sum([len(entries) for entries in sections.values()])
+
+
+class _ChangeTracker(object):
+    """Remembers when each test last passed, to select the tests whose
+    dependencies (see _TestModuleCache.dependencies) changed since then.
+    """
+
+    def __init__(self, module_cache, store):
+        self._module_cache = module_cache
+        self._store = store
+
+    def selector(self):
+        """Return a function that tells whether a test id has to run again."""
+        passed = self._store.section('passed')
+        modified = {}
+        def is_changed(test_id):
+            passed_time = passed.get(test_id)
+            if passed_time is None:
+                return True
+            module_name = test_id.rsplit('.', 2)[0]
+            if module_name not in modified:
+                modified[module_name] = self._modified_time(module_name)
+            return modified[module_name] > passed_time
+        return is_changed
+
+    def _modified_time(self, module_name):
+        files = self._module_cache.dependencies(module_name)
+        if files is None:
+            module = sys.modules.get(module_name)
+            files = module and [_source_file(module)] or []
+        if not files:
+            return time.time()
+        modified_time = 0
+        for path in files:
+            try:
+                modified_time = max(modified_time, os.stat(path).st_mtime)
+            except OSError:
+                return time.time()
+        return modified_time
+
+    def record(self, outcomes, start_time):
+        for test_id, status, duration in outcomes:
+            if status == 'success':
+                self._store.set('passed', test_id, start_time)
+            else:
+                self._store.remove('passed', test_id)
+
+
+class _RunHistory(object):
+    """Remembers the status and duration of each test when it last ran."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def tests(self):
+        return self._store.section('history')
+
+    def failed(self):
+        failed = {}
+        for test_id, entry in self.tests().items():
+            if entry['status'] != 'success':
+                failed[test_id] = True
+        return failed
+
+    def record(self, outcomes, start_time):
+        for test_id, status, duration in outcomes:
+            self._store.set('history', test_id,
+                            {'status': status, 'time': duration, 'when': start_time})
+
+
+def _duration_history(history=None):
+    """Return the last duration of each test in the history (the run history
+    of this process by default) and the duration to assume for a test
+    without history: the median of the known ones.
+    """
+    if history is None:
+        history = _run_history.tests()
+    durations = dict([(test_id, entry['time']) for test_id, entry in history.items()])
+    if not durations:
+        return durations, _DEFAULT_TEST_DURATION
+    known = sorted(durations.values())
+    return durations, known[len(known) // 2]
+
+
+def _estimate_durations(test_ids, history=None):
+    durations, default = _duration_history(history)
+    return dict([(test_id, durations.get(test_id, default)) for test_id in test_ids])
+
+
+_local_store = _LocalStore(_LOCAL_STORE_FILE)
+_change_tracker = _ChangeTracker(_test_module_cache, _local_store)
+_run_history = _RunHistory(_local_store)
+
+
+def _result_outcomes(result):
+    """Return the (test id, status, duration) of each test of a timed test
+    result.
+    """
+    statuses = {}
+    for test, err in result.errors:
+        statuses[test.id()] = 'error'
+    for test, err in result.failures:
+        statuses[test.id()] = 'failure'
+    return [(timing['name'], statuses.get(timing['name'], 'success'), timing['time'])
+            for timing in result.timer.timings]
+
+
+def _record_run(outcomes, start_time):
+    """Remember the outcome of the tests of a run that started at start_time."""
+    _record_run_lock.acquire()
+    try:
+        _change_tracker.record(outcomes, start_time)
+        _run_history.record(outcomes, start_time)
+        _local_store.save()
+    finally:
+        _record_run_lock.release()
+
+
+_record_run_lock = threading.Lock()
+
+
+##############################################################################
+# Run summaries
+##############################################################################
+
+
+class _RunSummary(object):
+    """Totals of the /test/run requests of one run, recorded as they finish."""
+
+    PERCENTILES = (50, 90, 95, 99)
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.requests = 0
+        self.runs = 0
+        self.errors = []
+        self.failures = []
+        self.durations = []  # sorted
+        self.started = None
+        self.finished = None
+
+    def record(self, result, start_time, stop_time):
+        """Add the result (a JsonTestResult.as_dict()) of a request."""
+        self.requests += 1
+        self.runs += result['runs']
+        self.errors.extend(result['errors'])
+        self.failures.extend(result['failures'])
+        for test in result['tests']:
+            bisect.insort(self.durations, test['time'])
+        if self.started is None or start_time < self.started:
+            self.started = start_time
+        if self.finished is None or stop_time > self.finished:
+            self.finished = stop_time
+
+    def totals(self):
+        return {'run': self.run_id, 'requests': self.requests, 'runs': self.runs,
+                'errors': len(self.errors), 'failures': len(self.failures)}
+
+    def as_dict(self):
+        result = self.totals()
+        result['time'] = (self.finished or 0.0) - (self.started or 0.0)
+        result['percentiles'] = dict([(str(p), self.percentile(p)) for p in self.PERCENTILES])
+        result['slowest'] = self.durations and self.durations[-1] or 0.0
+        result['errorDetails'] = self.errors
+        result['failureDetails'] = self.failures
+        return result
+
+    def percentile(self, percent):
+        """Return the test duration below which percent of the durations are
+        (nearest rank).
+        """
+        if not self.durations:
+            return 0.0
+        rank = (len(self.durations) * percent + 99) // 100
+        return self.durations[max(0, rank - 1)]
+
+
+class _RunSummaries(object):
+    """The summaries of the last runs of the process, by run id."""
+
+    def __init__(self, size=_MAX_RUN_SUMMARIES):
+        self.size = size
+        self._summaries = {}
+        self._run_ids = []
+        self._lock = threading.Lock()
+
+    def new_run_id(self):
+        return uuid.uuid4().hex[:12]
+
+    def record(self, run_id, result, start_time, stop_time):
+        """Record a result in the summary of the run and return its totals."""
+        self._lock.acquire()
+        try:
+            summary = self._summaries.get(run_id)
+            if summary is None:
+                summary = self._summaries[run_id] = _RunSummary(run_id)
+                self._run_ids.append(run_id)
+                if len(self._run_ids) > self.size:
+                    del self._summaries[self._run_ids.pop(0)]
+            summary.record(result, start_time, stop_time)
+            return summary.totals()
+        finally:
+            self._lock.release()
+
+    def get(self, run_id):
+        """Return the summary of the run as a dictionary, or None if unknown."""
+        self._lock.acquire()
+        try:
+            summary = self._summaries.get(run_id)
+            return summary and summary.as_dict()
+        finally:
+            self._lock.release()
+
+
+_run_summaries = _RunSummaries()
+
+
+def _summarize_run(run_id, result, start_time):
+    """Record a JsonTestResult of the run (if run_id) and add the totals of
+    the run so far to it.
+    """
+    if run_id:
+        result.summary = _run_summaries.record(run_id, result.as_dict(), start_time, time.time())
+
+
 ################################################
 # Browser HTML, CSS, and Javascript
 ################################################
@@ -458,12 +2680,37 @@ _MAIN_PAGE_CONTENT = """
         #errorarea {padding-top:25px}
         .error {border-color: #c3d9ff; border-style: solid; border-width: 2px 1px 2px 1px; width:750px; padding:1px; margin:0pt auto; text-align:left}
         .errtitle {background-color:#c3d9ff; font-weight:bold}
+        #timingarea {padding-top:25px}
+        #timings {margin:0pt auto; font-size:83%%; border-collapse:collapse}
+        #timings th {background-color:#c3d9ff; cursor:pointer; padding:1px 6px}
+        #timings td {text-align:right; padding:1px 6px}
+        #timings td.testname {text-align:left}
+        #timings td.profile {text-align:left; padding:4px 6px 8px 24px}
+        .hotspots {display:inline-table; vertical-align:top; margin-right:12px; border-collapse:collapse}
+        .hotspots th {background-color:#e5ecf9; padding:1px 6px}
+        .hotspots td.function {text-align:left; font-family:monospace}
     </style>
     <script language="javascript" type="text/javascript">
         var testsToRun = %s;
+        var schedule = %s;
+        var runId = %s;
+        var profileTests = %s;
+        var summaryUrl = "%s/summary?run=" + encodeURIComponent(runId);
+        var batchSize = 20;
+        var batchDuration = 2;
+        var maxConcurrency = 16;
+        var concurrency = 2;
+        var runQueue = [];
+        var runningRequests = 0;
+        var bestOverhead = null;
+        var startTime = null;
         var totalRuns = 0;
         var totalErrors = 0;
         var totalFailures = 0;
+        var testTimings = [];
+        var timingColumns = [["name", "Test"], ["status", "Status"], ["time", "Time (s)"],
+                             ["setUp", "setUp"], ["test", "test"], ["tearDown", "tearDown"]];
+        var timingSortKey = "time";
 
         function newXmlHttp() {
           try { return new XMLHttpRequest(); } catch(e) {}
@@ -473,22 +2720,33 @@ _MAIN_PAGE_CONTENT = """
           return null;
         }
         
-        function requestTestRun(moduleName, className, methodName) {
-            var methodSuffix = "";
-            if (methodName) {
-                methodSuffix = "." + methodName;
+        function requestTestRun(testNames) {
+            var query = ["run=" + encodeURIComponent(runId)];
+            if (profileTests) {
+                query.push("profile=1");
+            }
+            for (var i = 0; i < testNames.length; i++) {
+                query.push("name=" + encodeURIComponent(testNames[i]));
             }
             var xmlHttp = newXmlHttp();
-            xmlHttp.open("GET", "%s/run?name=" + moduleName + "." + className + methodSuffix, true);
+            var sentTime = new Date().getTime();
+            xmlHttp.open("GET", "%s/run?" + query.join("&"), true);
             xmlHttp.onreadystatechange = function() {
                 if (xmlHttp.readyState != 4) {
                     return;
                 }
+                runningRequests -= 1;
+                var latency = new Date().getTime() - sentTime;
                 if (xmlHttp.status == 200) {
-                    var result = eval("(" + xmlHttp.responseText + ")");
-                    totalRuns += parseInt(result.runs);
-                    totalErrors += result.errors.length;
-                    totalFailures += result.failures.length;
+                    var result = JSON.parse(xmlHttp.responseText);
+                    adaptConcurrency(latency - result.time * 1000);
+                    // The server adds up the requests of the run; responses can
+                    // arrive out of order, so keep the latest totals.
+                    if (result.summary.runs >= totalRuns) {
+                        totalRuns = result.summary.runs;
+                        totalErrors = result.summary.errors;
+                        totalFailures = result.summary.failures;
+                    }
                     document.getElementById("testran").innerHTML = totalRuns;
                     document.getElementById("testerror").innerHTML = totalErrors;
                     document.getElementById("testfailure").innerHTML = totalFailures;
@@ -515,14 +2773,166 @@ _MAIN_PAGE_CONTENT = """
                     }
                     var errorArea = document.getElementById("errorarea");
                     errorArea.innerHTML += details;
+                    testTimings = testTimings.concat(result.tests);
+                    renderTimings();
                 } else {
                     document.getElementById("errorarea").innerHTML = xmlHttp.responseText;
                     testFailed();
+                    adaptConcurrency(null);
                 }
+                runQueuedTests();
             };
             xmlHttp.send(null);            
         }
 
+        // Adapts the number of concurrent requests to the time a request spends
+        // outside of its tests (queueing in the server, transfer):  one more
+        // request per round trip while the overhead stays close to the best one
+        // seen, half as many when it grows or a request fails.
+        function adaptConcurrency(overhead) {
+            if (overhead == null) {
+                concurrency = Math.max(1, concurrency / 2);
+                return;
+            }
+            if (bestOverhead == null || overhead < bestOverhead) {
+                bestOverhead = overhead;
+            }
+            if (overhead > 2 * bestOverhead + 50) {
+                concurrency = Math.max(1, concurrency / 2);
+            } else if (overhead < 1.5 * bestOverhead + 20) {
+                concurrency = Math.min(maxConcurrency, concurrency + 1 / concurrency);
+            }
+        }
+
+        function runQueuedTests() {
+            while (runningRequests < Math.floor(concurrency) && runQueue.length > 0) {
+                runningRequests += 1;
+                requestTestRun(runQueue.shift());
+            }
+            var seconds = (new Date().getTime() - startTime) / 1000;
+            var throughput = seconds > 0 ? totalRuns / seconds : 0;
+            document.getElementById("throughput").innerHTML = throughput.toFixed(1);
+            document.getElementById("queuedepth").innerHTML = runQueue.length;
+            document.getElementById("concurrency").innerHTML = runningRequests;
+            var predicted = seconds + predictMakespan(runQueue, Math.max(1, Math.floor(concurrency)));
+            document.getElementById("predicted").innerHTML = predicted.toFixed(1);
+            document.getElementById("elapsed").innerHTML = seconds.toFixed(1);
+        }
+
+        function estimateDuration(testName) {
+            var duration = schedule.durations[testName];
+            return duration == null ? schedule["default"] : duration;
+        }
+
+        // Groups the tests into batches of at most batchSize tests or batchDuration
+        // estimated seconds and queues them longest first, which is the
+        // longest-processing-time-first schedule for the concurrent requests.
+        function scheduleBatches(testNames) {
+            var tests = [];
+            for (var i = 0; i < testNames.length; i++) {
+                tests.push({name: testNames[i], duration: estimateDuration(testNames[i])});
+            }
+            if (!schedule.ordered) {
+                tests.sort(function(a, b) { return b.duration - a.duration; });
+            }
+            var batches = [];
+            var batch = [];
+            for (var i = 0; i < tests.length; i++) {
+                if (batch.length == batchSize ||
+                    (batch.length > 0 && batch.duration + tests[i].duration > batchDuration)) {
+                    batches.push(batch);
+                    batch = [];
+                }
+                batch.push(tests[i].name);
+                batch.duration = (batch.duration || 0) + tests[i].duration;
+            }
+            if (batch.length > 0) {
+                batches.push(batch);
+            }
+            if (!schedule.ordered) {
+                batches.sort(function(a, b) { return b.duration - a.duration; });
+            }
+            return batches;
+        }
+
+        function predictMakespan(batches, slots) {
+            var loads = [];
+            for (var i = 0; i < slots; i++) {
+                loads.push(0);
+            }
+            for (var i = 0; i < batches.length; i++) {
+                var least = 0;
+                for (var j = 1; j < slots; j++) {
+                    if (loads[j] < loads[least]) {
+                        least = j;
+                    }
+                }
+                loads[least] += batches[i].duration;
+            }
+            return Math.max.apply(Math, loads);
+        }
+
+        function sortTimings(column) {
+            timingSortKey = timingColumns[column][0];
+            renderTimings();
+        }
+
+        function renderTimings() {
+            var key = timingSortKey;
+            testTimings.sort(function(a, b) {
+                if (key == "name" || key == "status") {
+                    return a[key] < b[key] ? -1 : (a[key] > b[key] ? 1 : 0);
+                }
+                return b[key] - a[key];
+            });
+            var columns = timingColumns;
+            var html = '<table id="timings"><tbody><tr>';
+            for (var i = 0; i < columns.length; i++) {
+                html += '<th onclick="sortTimings(' + i + ')">' + columns[i][1] + '</th>';
+            }
+            html += '</tr>';
+            for (var i = 0; i < testTimings.length; i++) {
+                var timing = testTimings[i];
+                var name = timing.name;
+                if (timing.profile) {
+                    name = '<a href="javascript:toggleProfile(' + i + ')">' + name + '</a>';
+                }
+                html += '<tr><td class="testname">' + name + '</td><td>' + timing.status + '</td>';
+                for (var j = 2; j < columns.length; j++) {
+                    html += '<td>' + timing[columns[j][0]].toFixed(3) + '</td>';
+                }
+                html += '</tr>';
+                if (timing.profile && timing.showProfile) {
+                    html += '<tr><td class="profile" colspan="' + columns.length + '">' +
+                            renderHotspots(timing.profile, "cumulative") +
+                            renderHotspots(timing.profile, "self") + '</td></tr>';
+                }
+            }
+            html += '</tbody></table>';
+            document.getElementById("timingarea").innerHTML = html;
+        }
+
+        function toggleProfile(index) {
+            testTimings[index].showProfile = !testTimings[index].showProfile;
+            renderTimings();
+        }
+
+        function renderHotspots(profile, key) {
+            var html = '<table class="hotspots"><tbody><tr><th>By ' + key +
+                       ' time (s)</th><th>Calls</th><th>Function</th></tr>';
+            var functions = profile[key];
+            for (var i = 0; i < functions.length; i++) {
+                html += '<tr><td>' + functions[i][key].toFixed(3) + '</td><td>' +
+                        functions[i].calls + '</td><td class="function">' +
+                        escapeHtml(functions[i]["function"]) + '</td></tr>';
+            }
+            return html + '</tbody></table>';
+        }
+
+        function escapeHtml(text) {
+            return text.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+        }
+
         function testFailed() {
             document.getElementById("testindicator").style.backgroundColor="red";
         }
@@ -532,25 +2942,16 @@ _MAIN_PAGE_CONTENT = """
         }
         
         function runTests() {
-            // Run each test asynchronously (concurrently).
-            var totalTests = 0;
-            for (var moduleName in testsToRun) {
-                var classes = testsToRun[moduleName];
-                for (var className in classes) {
-                    // TODO: Optimize for the case where tests are run by class so we don't
-                    //       have to always execute each method separately.  This should be
-                    //       possible when we have a UI that allows the user to select tests
-                    //       by module, class, and method.
-                    //requestTestRun(moduleName, className);
-                    methods = classes[className];
-                    for (var i = 0; i < methods.length; i++) {
-                        totalTests += 1;
-                        var methodName = methods[i];
-                        requestTestRun(moduleName, className, methodName);
-                    }
-                }
-            }
+            // Queue the tests in batches and run the queue asynchronously
+            // (concurrently).
+            var totalTests = testsToRun.length;
+            runQueue = scheduleBatches(testsToRun);
             document.getElementById("testtotal").innerHTML = totalTests;
+            var summaryLink = document.getElementById("summary");
+            summaryLink.href = summaryUrl;
+            summaryLink.innerHTML = runId;
+            startTime = new Date().getTime();
+            runQueuedTests();
         }
 
     </script>
@@ -569,9 +2970,22 @@ _MAIN_PAGE_CONTENT = """
                 <td>Errors: <span id="testerror">0</span></td>
                 <td>Failures: <span id="testfailure">0</span></td>
             </tr>
+            <tr>
+                <td>Tests/sec: <span id="throughput">0</span></td>
+                <td>Queue: <span id="queuedepth">0</span></td>
+                <td>Requests: <span id="concurrency">0</span></td>
+            </tr>
+            <tr>
+                <td colspan="3">Elapsed: <span id="elapsed">0</span>s,
+                    predicted: <span id="predicted">0</span>s</td>
+            </tr>
+            <tr>
+                <td colspan="3">Run: <a id="summary"></a></td>
+            </tr>
         </tbody></table>
     </div>
     <div id="errorarea"></div>
+    <div id="timingarea"></div>
     <div id="footerarea">
         <div id="weblink">
         <p>
@@ -589,6 +3003,250 @@ _MAIN_PAGE_CONTENT = """
 """
 
 
+##############################################################################
+# Command line runner
+##############################################################################
+
+
+def _run_from_command_line(args, stream=None):
+    """Run tests outside the web server, spread over worker processes.
+
+    Returns the exit code: 0 if all tests passed, 1 if any test failed and 2
+    if the tests could not be loaded.
+    """
+    from optparse import OptionParser
+    stream = stream or sys.stdout
+    parser = OptionParser(usage="%prog --run [options] [test names]")
+    parser.add_option("--run", action="store_true",
+                      help="run the tests from the command line")
+    parser.add_option("--dir", default=_LOCAL_TEST_DIR,
+                      help="directory of the test modules [default: %default]")
+    parser.add_option("--package", help="run all tests in a package")
+    parser.add_option("--processes", type="int", default=_cpu_count(),
+                      help="number of worker processes [default: %default]")
+    parser.add_option("--format", choices=["plain", "json"], default="plain",
+                      help="'plain' or 'json' [default: %default]")
+    parser.add_option("--app-id", dest="app_id",
+                      help="application id [default: read from app.yaml]")
+    parser.add_option("--changed", action="store_true", default=False,
+                      help="only run the tests whose code changed since they last passed")
+    parser.add_option("--rerun", choices=["failed"],
+                      help="'failed': only run the tests that failed when they last ran")
+    parser.add_option("--order", choices=["failed-first"],
+                      help="'failed-first': run the tests that failed when they last ran first")
+    parser.add_option("--shard", type="int", default=0,
+                      help="only run partition SHARD (from 0) of the tests [default: %default]")
+    parser.add_option("--shards", type="int", default=1,
+                      help="number of partitions of the tests [default: %default]")
+    parser.add_option("--shard-by", dest="shard_by", choices=["hash", "duration"], default="hash",
+                      help="'hash' or 'duration' [default: %default]")
+    parser.add_option("--history",
+                      help="the run history file that shards by duration read, the same for every shard")
+    parser.add_option("--store",
+                      help="file that keeps the run history between runs [default: %s]" %
+                      _LOCAL_STORE_FILE)
+    parser.add_option("--profile", action="store_true", default=False,
+                      help="profile each test and report the functions that took the most time")
+    parser.add_option("--profile-dir", dest="profile_dir",
+                      help="also save the profile of each test as a .pstats file in PROFILE_DIR")
+    parser.add_option("--slowest", type="int", default=_SLOWEST_TESTS_COUNT,
+                      help="number of slowest tests the plain output lists, 0 for all [default: %default]")
+    options, names = parser.parse_args(args)
+    if options.store:
+        _local_store.move(options.store)
+    selection, error = _TestSelection.create(changed=options.changed, rerun=options.rerun,
+                                             order=options.order, shard=options.shard,
+                                             shards=options.shards, shard_by=options.shard_by,
+                                             history=options.history)
+    if error:
+        parser.error(error)
+    if options.slowest < 0:
+        parser.error("--slowest must be a number of tests, or 0 for all.")
+    profile = options.profile or bool(options.profile_dir)
+    if profile and cProfile is None:
+        parser.error("The cProfile module needed by --profile is not available.")
+
+    app_id = options.app_id or _read_app_id()
+    _install_local_stubs(app_id)
+    test_names, error = _discover_test_names(options.package, names, options.dir)
+    if error:
+        stream.write(error + "\n")
+        return 2
+    test_names = selection.select(test_names)
+
+    start_time = time.time()
+    durations = _estimate_durations(test_names)
+    workers, loads = _schedule_longest_first(test_names, durations, options.processes)
+    # Keep the selected order (and so the classes together) within a worker.
+    positions = dict([(name, i) for i, name in enumerate(test_names)])
+    for worker_tests in workers:
+        worker_tests.sort(key=positions.get)
+    if len(workers) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(len(workers), _init_worker_process,
+                                    (app_id, options.dir))
+        try:
+            results = pool.map(_run_worker_tests,
+                               [(worker_tests, profile, options.profile_dir)
+                                for worker_tests in workers], 1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_run_test_names(worker_tests, profile, options.profile_dir)
+                   for worker_tests in workers]
+    result = _merge_results(results)
+    result['time'] = time.time() - start_time
+    result['schedule'] = {'workers': len(workers), 'predicted': max(loads + [0.0]),
+                          'actual': result['time']}
+    _record_run([(test['name'], test['status'], test['time']) for test in result['tests']],
+                start_time)
+
+    if options.format == "json":
+        stream.write(django.utils.simplejson.dumps(result) + "\n")
+    else:
+        _write_plain_results(stream, result, options.slowest)
+    if result['errors'] or result['failures']:
+        return 1
+    return 0
+
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def _read_app_id():
+    try:
+        app_yaml = open('app.yaml')
+        try:
+            match = re.search(r"^application:\s*(\S+)", app_yaml.read(), re.M)
+        finally:
+            app_yaml.close()
+    except IOError:
+        match = None
+    return match and match.group(1) or 'gaeunit'
+
+
+def _install_local_stubs(app_id):
+    """Install the API stubs of the SDK in place of the development server."""
+    from google.appengine.api import mail_stub
+    from google.appengine.api import urlfetch_stub
+    from google.appengine.api import user_service_stub
+    from google.appengine.api.memcache import memcache_stub
+    os.environ.setdefault('APPLICATION_ID', app_id)
+    os.environ.setdefault('AUTH_DOMAIN', 'gmail.com')
+    os.environ.setdefault('SERVER_NAME', 'localhost')
+    os.environ.setdefault('SERVER_PORT', '8080')
+    os.environ.setdefault('USER_EMAIL', '')
+    apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+    apiproxy_stub_map.apiproxy.RegisterStub('mail', mail_stub.MailServiceStub())
+    apiproxy_stub_map.apiproxy.RegisterStub('urlfetch', urlfetch_stub.URLFetchServiceStub())
+    apiproxy_stub_map.apiproxy.RegisterStub('user', user_service_stub.UserServiceStub())
+    apiproxy_stub_map.apiproxy.RegisterStub('memcache', memcache_stub.MemcacheServiceStub())
+    try:
+        from google.appengine.api.images import images_stub
+        apiproxy_stub_map.apiproxy.RegisterStub('images', images_stub.ImagesServiceStub())
+    except ImportError:
+        # The images stub needs PIL.
+        pass
+
+
+def _init_worker_process(app_id, test_dir):
+    if not test_dir in sys.path:
+        sys.path.append(test_dir)
+    _install_local_stubs(app_id)
+
+
+def _discover_test_names(package_name, names, test_dir):
+    """Return the ids of the tests to run and an error message, if any."""
+    tests = []
+    for name in names or [None]:
+        suite, error = _create_suite(package_name, name, test_dir)
+        if error:
+            return [], error
+        _get_tests_from_suite(suite, tests)
+    return [test.id() for test in tests], None
+
+
+def _schedule_longest_first(test_names, durations, count):
+    """Assign the tests to at most count workers, longest test first, each to
+    the worker with the least work so far.
+
+    Returns the tests of each worker and the estimated duration of each
+    worker's tests.
+    """
+    count = max(1, min(count, len(test_names)))
+    workers = [[] for i in range(count)]
+    loads = [0.0] * count
+    queue = [(0.0, i) for i in range(count)]
+    longest_first = sorted(test_names, key=lambda name: (-durations[name], name))
+    for name in longest_first:
+        load, worker = heapq.heappop(queue)
+        workers[worker].append(name)
+        loads[worker] = load + durations[name]
+        heapq.heappush(queue, (loads[worker], worker))
+    return [tests for tests in workers if tests], [load for tests, load in zip(workers, loads) if tests]
+
+
+def _run_test_names(test_names, profile=False, profile_dir=None):
+    """Run the named tests in this process and return the result as a dict."""
+    suite = unittest.defaultTestLoader.loadTestsFromNames(test_names)
+    runner = JsonTestRunner(profile and _TestProfiler(dump_dir=profile_dir) or None)
+    _run_test_suite(runner, suite)
+    return runner.result.as_dict()
+
+
+def _run_worker_tests(arguments):
+    return _run_test_names(*arguments)
+
+
+def _merge_results(results):
+    merged = {'runs': 0, 'total': 0, 'time': 0.0,
+              'errors': [], 'failures': [], 'tests': []}
+    for result in results:
+        merged['runs'] += result['runs']
+        merged['total'] += result['total']
+        merged['time'] += result['time']
+        merged['errors'].extend(result['errors'])
+        merged['failures'].extend(result['failures'])
+        merged['tests'].extend(result['tests'])
+    return merged
+
+
+def _write_plain_results(stream, result, slowest=_SLOWEST_TESTS_COUNT):
+    stream.write("====================\n" \
+                 "GAEUnit Test Results\n" \
+                 "====================\n\n")
+    for flavour, entries in (("ERROR", result['errors']), ("FAIL", result['failures'])):
+        for entry in entries:
+            stream.write("%s\n%s: %s\n%s\n%s\n" % ("=" * 70, flavour, entry['desc'],
+                                                 "-" * 70, unescape(entry['detail'])))
+    stream.write("%s\nRan %d test%s in %.3fs\n\n" % ("-" * 70, result['runs'],
+                                                     result['runs'] != 1 and "s" or "",
+                                                     result['time']))
+    if result['errors'] or result['failures']:
+        counts = []
+        if result['failures']:
+            counts.append("failures=%d" % len(result['failures']))
+        if result['errors']:
+            counts.append("errors=%d" % len(result['errors']))
+        stream.write("FAILED (%s)\n" % ", ".join(counts))
+    else:
+        stream.write("OK\n")
+    slowest_tests = _slowest(result['tests'], slowest)
+    _write_slowest_tests(stream, slowest_tests)
+    _write_profiles(stream, slowest_tests)
+    schedule = result.get('schedule')
+    if schedule:
+        stream.write("\n%d worker%s, predicted makespan %.3fs, actual %.3fs\n" %
+                     (schedule['workers'], schedule['workers'] != 1 and "s" or "",
+                      schedule['predicted'], schedule['actual']))
+
+
 ##############################################################################
 # Script setup and execution
 ##############################################################################
@@ -596,10 +3254,13 @@ _MAIN_PAGE_CONTENT = """
 
 application = webapp.WSGIApplication([('%s'      % _WEB_TEST_DIR, MainTestPageHandler),
                                       ('%s/run'  % _WEB_TEST_DIR, JsonTestRunHandler),
-                                      ('%s/list' % _WEB_TEST_DIR, JsonTestListHandler)],
+                                      ('%s/list' % _WEB_TEST_DIR, JsonTestListHandler),
+                                      ('%s/summary' % _WEB_TEST_DIR, JsonTestSummaryHandler)],
                                       debug=True)
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        sys.exit(_run_from_command_line(sys.argv[1:]))
     run_wsgi_app(application)                                    
 
 if __name__ == '__main__':
@@ -1,6 +1,7 @@
 import unittest
 import logging
 from google.appengine.ext import db
+import gaeunit
 import model
 
 class SuccessFailError(unittest.TestCase):
@@ -51,3 +52,21 @@ class ModelTest(unittest.TestCase):
     self.assertEqual('Bar', entity.name)
 
 
+class ModelFixtureTest(gaeunit.GAETestCase):
+
+  def setUpDatastoreFixture(self):
+    # Populate test entities once; they are restored before each test.
+    entity = model.MyEntity(name='Bar')
+    return entity.put()
+
+  def test_fixture_entity(self):
+    entity = db.get(self.datastoreFixture)
+    self.assertEqual('Bar', entity.name)
+
+  def test_fixture_is_restored(self):
+    model.MyEntity(name='Foo').put()
+    self.assertEqual(2, model.MyEntity.all().count())
+
+  def test_fixture_is_restored_again(self):
+    self.assertEqual(1, model.MyEntity.all().count())
+
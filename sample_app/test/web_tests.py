@@ -19,3 +19,10 @@ class IndexTest(unittest.TestCase):
       response = app.get('/?name=Bob')
       self.assertEqual('200 OK', response.status)
       self.assertTrue('Hello, Bob!' in response)
+
+  def test_page_under_load(self):
+      app = TestApp(self.application)
+      result = app.load('/', requests=50, concurrency=5)
+      self.assertEqual(50, result.requests, str(result))
+      self.assertEqual({200: 50}, result.statuses, str(result))
+      self.assertEqual(0, result.errors, str(result))
@@ -0,0 +1,189 @@
+import re
+import sys
+import unittest
+from StringIO import StringIO
+import webtest
+from webtest import TestApp
+
+PAGE = '''<html><body>
+<form id="search" action="/search" method="GET">
+<input type="text" name="q" value="gae">
+<select name="lang"><option value="en" selected>English<option value="de">German</select>
+<input type="radio" name="size" value="s"><input type="radio" name="size" value="l" checked>
+<input type="submit" name="go" value="Go">
+</form>
+<a href="/one" id="first">First</a>
+<A HREF="/two"
+   class="x">Second <b>link</b></A>
+<a name="anchor">No href</a>
+<a href="#top">Top</a>
+<a href="/outer">Outer <a href="/inner">Inner</a> rest</a>
+<a>No attributes</a><abbr title="t">abbr</abbr>
+<form action="/post" method="POST"><textarea name="body">some &amp; text</textarea>
+<input type="checkbox" name="ok" checked><button name="send" value="1">Send</button></form>
+<a href="/unclosed">Unclosed
+</body></html>'''
+
+
+LESS_THAN_PAGE = '<p>1 < 2 <a href="/x">x</a></p>'
+
+
+def page_app(environ, start_response):
+    if environ['PATH_INFO'] == '/':
+        body = PAGE
+    elif environ['PATH_INFO'] == '/less-than':
+        body = LESS_THAN_PAGE
+    else:
+        body = 'You are at %s' % environ['PATH_INFO']
+    start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def regex_elements(body, tag):
+    """The elements webtest found with one regular expression per tag."""
+    element_re = re.compile(r'<%s\s+(.*?)>(.*?)</%s>' % (tag, tag), re.I+re.S)
+    return [(match.group(0), match.group(1), match.group(2),
+             webtest._parse_attrs(match.group(1)))
+            for match in element_re.finditer(body)]
+
+
+class ElementIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = TestApp(page_app)
+        self.response = self.app.get('/')
+
+    def test_elements_match_regex_search(self):
+        bodies = [PAGE, '<a href="/x"><a href="/y">y</a></a><a\thref="/z">z</A >',
+                  '<a href="/x">no end', '', '<p>no links</p>', LESS_THAN_PAGE,
+                  '<!-- <a href="/c">c</a> --><a href="/x">x</a>', '<p>1 < 2 <!-- > <a href="/x">x</a>']
+        for body in bodies:
+            index = webtest.ElementIndex(body)
+            for tag in ('a', 'button', 'abbr', 'form'):
+                self.assertEqual(regex_elements(body, tag), index.elements(tag))
+
+    def test_forms(self):
+        forms = self.response.forms
+        self.assertEqual([0, 1, 'search'], sorted(forms.keys()))
+        search = forms['search']
+        self.assertTrue(search is forms[0])
+        self.assertEqual(('/search', 'GET'), (search.action, search.method))
+        self.assertEqual(['go', 'lang', 'q', 'size'], sorted(search.fields.keys()))
+        self.assertEqual(('gae', 'en', 'l'),
+                         (search['q'].value, search['lang'].value, search['size'].value))
+        post = forms[1]
+        self.assertEqual(('/post', 'POST', None), (post.action, post.method, post.id))
+        self.assertEqual('some & text', post['body'].value)
+        self.assertEqual(True, post['ok'].checked)
+        self.assertTrue(post.text.startswith('<form action="/post"'))
+        self.assertTrue(post.text.endswith('</form>'))
+
+    def test_form_submit(self):
+        form = self.response.forms['search']
+        form['q'] = 'webtest'
+        self.assertEqual('You are at /search', form.submit('go').body)
+
+    def test_click(self):
+        self.assertEqual('You are at /one', self.response.click('First').body)
+        self.assertEqual('You are at /two', self.response.click('Second').body)
+        self.assertEqual('You are at /one', self.response.click(linkid='first').body)
+        self.assertEqual('You are at /outer', self.response.click(href='outer').body)
+        self.assertRaises(IndexError, self.response.click, 'Unclosed')
+        self.assertRaises(IndexError, self.response.click, 'Top')
+
+    def test_click_after_bare_less_than(self):
+        response = TestApp(page_app).get('/less-than')
+        self.assertEqual('You are at /x', response.click('x').body)
+
+    def test_index_follows_body(self):
+        index = self.response.element_index
+        self.assertTrue(index is self.response.element_index)
+        self.response.body = '<a href="/new">New</a>'
+        self.assertEqual(['/new'], [attrs['href'] for html, attr_text, content, attrs
+                                    in self.response.element_index.elements('a')])
+
+
+class MustContainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.response = TestApp(page_app).get('/one')
+        # mustcontain() prints the response when it fails.
+        self.stderr = sys.stderr
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+
+    def test_mustcontain(self):
+        self.response.mustcontain('You are', u'at /one', no=['/two', u'missing'])
+        self.response.mustcontain('You are', no='You are not')
+
+    def test_mustcontain_failures(self):
+        self.assertRaises(IndexError, self.response.mustcontain, 'missing')
+        self.assertRaises(IndexError, self.response.mustcontain, no='/one')
+        self.assertRaises(IndexError, self.response.mustcontain, no=[u'missing', u'at /one'])
+        try:
+            self.response.mustcontain('You', no=['missing', 'You are'])
+        except IndexError, e:
+            self.assertEqual("Body contains string 'You are'", str(e))
+        else:
+            self.fail("mustcontain() did not fail")
+        self.assertRaises(TypeError, self.response.mustcontain, 'You', yes='You')
+
+    def test_changed_body(self):
+        self.response.mustcontain(u'/one', 'You are', no=[u'missing', 'missing'])
+        self.response.body = 'Now  somewhere\nelse'
+        self.response.mustcontain(u'somewhere else', 'Now somewhere', no=[u'/one', 'You are'])
+        self.assertFalse(u'You are' in self.response)
+        self.assertTrue(self.response.unicode_normal_body == u'Now somewhere else')
+
+
+def invalid_app(environ, start_response):
+    # The Status header is not allowed by the WSGI validator (lint).
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Status', '200 OK')])
+    return ['invalid']
+
+
+def cookie_app(environ, start_response):
+    headers = [('Content-Type', 'text/plain')]
+    if environ['PATH_INFO'] == '/login':
+        headers.append(('Set-Cookie', 'session=s1'))
+    start_response('200 OK', headers)
+    return [environ.get('HTTP_COOKIE', '')]
+
+
+class FastModeTest(unittest.TestCase):
+
+    def test_lint_checks_each_request(self):
+        app = TestApp(invalid_app)
+        self.assertRaises(AssertionError, app.get, '/a')
+        self.assertRaises(AssertionError, app.get, '/a')
+
+    def test_fast_lint_checks_first_request_of_each_route(self):
+        app = TestApp(invalid_app, fast=True)
+        self.assertRaises(AssertionError, app.get, '/a')
+        self.assertEqual('invalid', app.get('/a').body)
+        self.assertRaises(AssertionError, app.get, '/b')
+        self.assertRaises(AssertionError, app.post, '/a')
+        self.assertEqual('invalid', app.post('/a').body)
+
+    def test_capture_stdout(self):
+        self.assertEqual((True, False, True),
+                         (TestApp(page_app).capture_stdout, TestApp(page_app, fast=True).capture_stdout,
+                          TestApp(page_app, fast=True, capture_stdout=True).capture_stdout))
+
+    def test_cookie_header_follows_cookies(self):
+        app = TestApp(cookie_app, fast=True)
+        self.assertEqual('', app.get('/').body)
+        app.cookies['a'] = '1'
+        self.assertEqual('a=1', app.get('/').body)
+        self.assertEqual('a=1', app.get('/').body)
+        app.cookies['a'] = '2'
+        self.assertEqual('a=2', app.get('/').body)
+        app.get('/login')
+        self.assertEqual(['a=2', 'session=s1'], sorted(app.get('/').body.split('; ')))
+        del app.cookies['a']
+        self.assertEqual('session=s1', app.get('/').body)
+        app.reset()
+        self.assertEqual('', app.get('/').body)
@@ -14,6 +14,7 @@ import mimetypes
 import time
 import cgi
 import os
+import threading
 #import webbrowser
 from Cookie import BaseCookie
 try:
@@ -53,7 +54,8 @@ class TestApp(object):
     # for py.test
     disabled = True
 
-    def __init__(self, app, extra_environ=None, relative_to=None):
+    def __init__(self, app, extra_environ=None, relative_to=None,
+                 fast=False, capture_stdout=None):
         """
         Wraps a WSGI application in a more convenient interface for
         testing.
@@ -68,6 +70,13 @@ class TestApp(object):
         ``relative_to`` is a directory, and filenames used for file
         uploads are calculated relative to this.  Also ``config:``
         URIs that aren't absolute.
+
+        ``fast`` makes requests cheaper for tests that make many of
+        them: the WSGI validator (lint) only checks the first request
+        of each method and path, and ``print`` output of the
+        application is not captured unless ``capture_stdout`` is true.
+        ``capture_stdout`` defaults to true, or to false if ``fast``.
+        Captured output is copied to ``sys.stderr`` after each request.
         """
         if isinstance(app, (str, unicode)):
             from paste.deploy import loadapp
@@ -79,6 +88,11 @@ class TestApp(object):
         if extra_environ is None:
             extra_environ = {}
         self.extra_environ = extra_environ
+        self.fast = fast
+        if capture_stdout is None:
+            capture_stdout = not fast
+        self.capture_stdout = capture_stdout
+        self._linted = {}
         self.reset()
 
     def reset(self):
@@ -87,6 +101,21 @@ class TestApp(object):
         saved cookies.
         """
         self.cookies = {}
+        self._cookie_header = None
+
+    def _get_cookie_header(self):
+        """
+        The ``Cookie`` header of ``self.cookies``, serialized again
+        only when the cookies change.
+        """
+        if self._cookie_header is None or self._cookie_header[0] != self.cookies:
+            c = BaseCookie()
+            for name, value in self.cookies.items():
+                c[name] = value
+            header = '; '.join(['%s=%s' % (morsel.key, morsel.coded_value)
+                                for name, morsel in sorted(c.items())])
+            self._cookie_header = (self.cookies.copy(), header)
+        return self._cookie_header[1]
 
     def _make_environ(self, extra_environ=None):
         environ = self.extra_environ.copy()
@@ -227,6 +256,109 @@ class TestApp(object):
                                  extra_environ=extra_environ,status=status,
                                  upload_files=None, expect_errors=expect_errors)
 
+    def load(self, url, requests=100, concurrency=1, params=None,
+             headers=None, extra_environ=None, status=None):
+        """
+        Makes ``requests`` GET requests of ``url`` (with ``params``,
+        ``headers`` and ``extra_environ`` as in ``.get()``) from
+        ``concurrency`` threads at once, and returns a ``LoadResult``
+        with their throughput, latency percentiles, status codes and
+        errors.
+
+        A request is an error if the application raises an exception
+        or if its status is not ``status``, which is checked as in
+        ``.get()``, but without raising.  The cookies of the
+        ``TestApp`` are sent but not updated, and the requests are
+        neither validated nor have their output captured, which
+        would not be safe in several threads.
+
+        When the tests run with gaeunit, the threads use the API
+        stubs (and the datastore) of the calling test, and
+        ``LoadResult.rpcs`` has the number of API calls of each
+        request.
+        """
+        if params:
+            if not isinstance(params, (str, unicode)):
+                params = urllib.urlencode(params, doseq=True)
+            if '?' in url:
+                url += '&'
+            else:
+                url += '?'
+            url += params
+        url = str(url)
+        environ = self._make_environ(extra_environ)
+        if '?' in url:
+            url, environ['QUERY_STRING'] = url.split('?', 1)
+        else:
+            environ['QUERY_STRING'] = ''
+        if self.cookies:
+            environ['HTTP_COOKIE'] = self._get_cookie_header()
+        apiproxy, thread_apiproxy = _current_apiproxy()
+        recorder = _rpc_recorder(apiproxy)
+        result = LoadResult(concurrency, recorder is not None)
+        remaining = [requests]
+        lock = threading.Lock()
+
+        def run_request():
+            req = TestRequest.blank(url, environ.copy())
+            if headers:
+                req.headers.update(headers)
+            req.environ['wsgi.errors'] = StringIO()
+            req.environ['paste.testing'] = True
+            req.environ['paste.testing_variables'] = {}
+            if recorder is not None:
+                recorder.start()
+            recording = None
+            start_time = time.time()
+            try:
+                try:
+                    res = req.get_response(self.app, catch_exc_info=True)
+                    # Like do_request, make sure the app_iter is exhausted:
+                    res.body
+                except Exception, e:
+                    res = None
+                    error = e
+                else:
+                    error = None
+                    if not _status_matches(status, res.status_int):
+                        error = res.status
+            finally:
+                latency = time.time() - start_time
+                if recorder is not None:
+                    recording = recorder.stop()
+            result.add(latency, res is not None and res.status_int or None,
+                       error, recording)
+
+        def run_requests():
+            if thread_apiproxy is not None:
+                previous = apiproxy.set_current(thread_apiproxy)
+            try:
+                while True:
+                    lock.acquire()
+                    try:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                    finally:
+                        lock.release()
+                    run_request()
+            finally:
+                if thread_apiproxy is not None:
+                    apiproxy.set_current(previous)
+
+        threads = [threading.Thread(target=run_requests)
+                   for i in range(max(1, concurrency))]
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result.duration = time.time() - start_time
+        result.latencies.sort()
+        if result.rpcs is not None:
+            result.rpcs.sort()
+        return result
+
     def encode_multipart(self, params, files):
         """
         Encodes a set of parameters (typically a name/value list) and
@@ -285,24 +417,31 @@ class TestApp(object):
         errors = StringIO()
         req.environ['wsgi.errors'] = errors
         if self.cookies:
-            c = BaseCookie()
-            for name, value in self.cookies.items():
-                c[name] = value
-            req.environ['HTTP_COOKIE'] = str(c).split(': ', 1)[1]
+            req.environ['HTTP_COOKIE'] = self._get_cookie_header()
         req.environ['paste.testing'] = True
         req.environ['paste.testing_variables'] = {}
-        app = validator(self.app)
-        old_stdout = sys.stdout
-        out = CaptureStdout(old_stdout)
-        try:
+        app = self.app
+        if self.fast:
+            route = (req.environ.get('REQUEST_METHOD'),
+                     req.environ.get('PATH_INFO'))
+            if route not in self._linted:
+                self._linted[route] = True
+                app = validator(app)
+        else:
+            app = validator(app)
+        if self.capture_stdout:
+            old_stdout = sys.stdout
+            out = CaptureStdout(old_stdout)
             sys.stdout = out
+        try:
             start_time = time.time()
             ## FIXME: should it be an option to not catch exc_info?
             res = req.get_response(app, catch_exc_info=True)
             end_time = time.time()
         finally:
-            sys.stdout = old_stdout
-            sys.stderr.write(out.getvalue())
+            if self.capture_stdout:
+                sys.stdout = old_stdout
+                sys.stderr.write(out.getvalue())
         res.app = app
         res.test_app = self
         # We do this to make sure the app_iter is exausted:
@@ -355,6 +494,162 @@ class TestApp(object):
             raise AppError(
                 "Application had errors logged:\n%s" % errors)
 
+def _status_matches(status, status_int):
+    """
+    Whether ``status_int`` is the status expected by ``status``, as
+    ``TestApp._check_status`` checks it.
+    """
+    if status == '*':
+        return True
+    if isinstance(status, (list, tuple)):
+        return status_int in status
+    if status is None:
+        return status_int >= 200 and status_int < 400
+    return status == status_int
+
+def _current_apiproxy():
+    """
+    Returns the App Engine apiproxy (None outside App Engine) and, if
+    it is gaeunit's per-thread apiproxy, the one the current thread
+    uses, to be used by the threads of ``TestApp.load()`` too.
+    """
+    try:
+        from google.appengine.api import apiproxy_stub_map
+    except ImportError:
+        return None, None
+    apiproxy = apiproxy_stub_map.apiproxy
+    if hasattr(apiproxy, 'current') and hasattr(apiproxy, 'set_current'):
+        return apiproxy, apiproxy.current()
+    return apiproxy, None
+
+def _rpc_recorder(apiproxy):
+    """
+    Returns the ``rpc_recorder`` of gaeunit's API call recording
+    stubs, if the datastore stub of ``apiproxy`` is one, or None.
+    """
+    if apiproxy is None:
+        return None
+    stub = apiproxy.GetStub('datastore_v3')
+    recorder = getattr(stub, 'rpc_recorder', None)
+    if hasattr(recorder, 'start') and hasattr(recorder, 'stop'):
+        return recorder
+    return None
+
+class LoadResult(object):
+
+    """
+    The result of ``TestApp.load()``:
+
+    ``requests``:
+        the number of requests made.
+
+    ``concurrency``:
+        the number of threads that made them.
+
+    ``duration``:
+        the seconds it took to make them all.
+
+    ``latencies``:
+        the seconds each request took, sorted.
+
+    ``statuses``:
+        a dictionary of the number of responses by status code.
+
+    ``errors``:
+        the number of requests that raised an exception or had an
+        unexpected status; ``exceptions`` has the exceptions.
+
+    ``rpcs``:
+        the number of API calls of each request, sorted, or None if
+        they were not recorded; ``rpc_calls`` has the number of calls
+        of all requests by service and method (e.g.
+        ``'datastore_v3.Get'``).
+    """
+
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, concurrency, record_rpcs=False):
+        self.concurrency = concurrency
+        self.requests = 0
+        self.duration = 0.0
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.exceptions = []
+        if record_rpcs:
+            self.rpcs = []
+            self.rpc_calls = {}
+        else:
+            self.rpcs = None
+            self.rpc_calls = None
+        self._lock = threading.Lock()
+
+    def add(self, latency, status_int, error, recording):
+        self._lock.acquire()
+        try:
+            self.requests += 1
+            self.latencies.append(latency)
+            if status_int is not None:
+                self.statuses[status_int] = self.statuses.get(status_int, 0) + 1
+            if error is not None:
+                self.errors += 1
+                if isinstance(error, Exception):
+                    self.exceptions.append(error)
+            if recording is not None and self.rpcs is not None:
+                calls = 0
+                for key, entry in recording.items():
+                    calls += entry['calls']
+                    self.rpc_calls[key] = self.rpc_calls.get(key, 0) + entry['calls']
+                self.rpcs.append(calls)
+        finally:
+            self._lock.release()
+
+    def throughput__get(self):
+        if not self.duration:
+            return 0.0
+        return self.requests / self.duration
+
+    throughput = property(throughput__get,
+                          doc="""
+                          Requests per second
+                          """)
+
+    def percentile(self, percent, values=None):
+        """
+        The latency (or, given ``values``, the value) below which
+        ``percent`` percent of the requests are (nearest rank).
+        """
+        if values is None:
+            values = self.latencies
+        values = sorted(values)
+        if not values:
+            return 0.0
+        rank = (len(values) * percent + 99) // 100
+        return values[max(0, rank - 1)]
+
+    p50 = property(lambda self: self.percentile(50))
+    p95 = property(lambda self: self.percentile(95))
+    p99 = property(lambda self: self.percentile(99))
+
+    def __str__(self):
+        lines = ['%s requests from %s threads in %.3fs: %.1f requests/s'
+                 % (self.requests, self.concurrency, self.duration,
+                    self.throughput)]
+        lines.append('latency: %s, max %.1fms' % (
+            ', '.join(['p%s %.1fms' % (p, self.percentile(p) * 1000)
+                       for p in self.PERCENTILES]),
+            max(self.latencies or [0.0]) * 1000))
+        lines.append('statuses: %s; errors: %s' % (
+            ', '.join(['%s x%s' % (code, count) for code, count
+                       in sorted(self.statuses.items())]) or 'none',
+            self.errors))
+        if self.rpcs is not None:
+            lines.append('API calls per request: %s, max %s' % (
+                ', '.join(['p%s %s' % (p, self.percentile(p, self.rpcs))
+                           for p in self.PERCENTILES]),
+                max(self.rpcs or [0])))
+        return '\n'.join(lines)
+
 class CaptureStdout(object):
 
     def __init__(self, actual):
@@ -419,28 +714,43 @@ class TestResponse(Response):
 
     _tag_re = re.compile(r'<(/?)([:a-z0-9_\-]*)(.*?)>', re.S|re.I)
 
+    _element_index = None
+
+    def element_index__get(self):
+        body = self.body
+        if self._element_index is None or self._element_index.body is not body:
+            self._element_index = ElementIndex(body)
+        return self._element_index
+
+    element_index = property(element_index__get,
+                             doc="""
+                             The ``ElementIndex`` of the tags in the body,
+                             built when first used
+                             """)
+
     def _parse_forms(self):
         forms = self._forms_indexed = {}
-        form_texts = []
+        index = self.element_index
+        form_spans = []
         started = None
-        for match in self._tag_re.finditer(self.body):
-            end = match.group(1) == '/'
-            tag = match.group(2).lower()
-            if tag != 'form':
-                continue
-            if end:
-                assert started, (
-                    "</form> unexpected at %s" % match.start())
-                form_texts.append(self.body[started:match.end()])
+        for i in index.positions('form'):
+            start, end, closing, tag, attr_text = index.tags[i]
+            if closing:
+                assert started is not None, (
+                    "</form> unexpected at %s" % start)
+                form_spans.append((index.tags[started][0], end, started, i + 1))
                 started = None
             else:
-                assert not started, (
-                    "Nested form tags at %s" % match.start())
-                started = match.start()
-        assert not started, (
-            "Danging form: %r" % self.body[started:])
-        for i, text in enumerate(form_texts):
-            form = Form(self, text)
+                assert started is None, (
+                    "Nested form tags at %s" % start)
+                started = i
+        assert started is None, (
+            "Danging form: %r" % self.body[index.tags[started][0]:])
+        for i, (start, end, first_tag, end_tag) in enumerate(form_spans):
+            tags = [(tag_start - start, tag_end - start, closing, tag, attr_text)
+                    for (tag_start, tag_end, closing, tag, attr_text)
+                    in index.tags[first_tag:end_tag]]
+            form = Form(self, self.body[start:end], tags)
             forms[i] = form
             if form.id:
                 forms[form.id] = form
@@ -538,20 +848,14 @@ class TestResponse(Response):
         href_pat = _make_pattern(href_pattern)
         html_pat = _make_pattern(html_pattern)
 
-        _tag_re = re.compile(r'<%s\s+(.*?)>(.*?)</%s>' % (tag, tag),
-                             re.I+re.S)
-
         def printlog(s):
             if verbose:
                 print s
 
         found_links = []
         total_links = 0
-        for match in _tag_re.finditer(self.body):
-            el_html = match.group(0)
-            el_attr = match.group(1)
-            el_content = match.group(2)
-            attrs = _parse_attrs(el_attr)
+        for el_html, el_attr, el_content, attrs in self.element_index.elements(tag):
+            attrs = attrs.copy()
             if verbose:
                 printlog('Element: %r' % el_html)
             if not attrs.get(href_attr):
@@ -631,13 +935,9 @@ class TestResponse(Response):
 
     _normal_body_regex = re.compile(r'[ \n\r\t]+')
 
-    _normal_body = None
-    
     def normal_body__get(self):
-        if self._normal_body is None:
-            self._normal_body = self._normal_body_regex.sub(
-                ' ', self.body)
-        return self._normal_body
+        return self._for_body(
+            'normal_body', lambda: self._normal_body_regex.sub(' ', self.body))
 
     normal_body = property(normal_body__get,
                            doc="""
@@ -648,13 +948,29 @@ class TestResponse(Response):
         if not self.charset:
             raise AttributeError(
                 "You cannot access Response.unicode_normal_body unless charset is set")
-        return self.normal_body.decode(self.charset)
+        return self._for_body(
+            'unicode_normal_body', lambda: self.normal_body.decode(self.charset))
 
     unicode_normal_body = property(
         unicode_normal_body__get, doc="""
         Return the whitespace-normalized body, as unicode
         """.strip())
 
+    _body_values = None
+
+    def _for_body(self, name, make):
+        """
+        Returns the value ``name`` computed by ``make()`` from the
+        current body, computing it only once per body.
+        """
+        body = self.body
+        if self._body_values is None or self._body_values[0] is not body:
+            self._body_values = (body, {})
+        values = self._body_values[1]
+        if name not in values:
+            values[name] = make()
+        return values[name]
+
     def __contains__(self, s):
         """
         A response 'contains' a string if it is present in the body
@@ -667,12 +983,12 @@ class TestResponse(Response):
             else:
                 s = str(s)
         if isinstance(s, unicode):
-            body = self.unicode_body
-            normal_body = self.unicode_normal_body
-        else:
-            body = self.body
-            normal_body = self.normal_body
-        return s in body or s in normal_body
+            # The decoded bodies are kept, as mustcontain() searches
+            # them for each of its strings.
+            if s in self._for_body('unicode_body', lambda: self.unicode_body):
+                return True
+            return s in self.unicode_normal_body
+        return s in self.body or s in self.normal_body
 
     def mustcontain(self, *strings, **kw):
         """
@@ -701,10 +1017,10 @@ class TestResponse(Response):
                     "Body does not contain string %r" % s)
         for no_s in no:
             if no_s in self:
-                print >> sys.stderr, "Actual response (has %r)" % s
+                print >> sys.stderr, "Actual response (has %r)" % no_s
                 print >> sys.stderr, self
                 raise IndexError(
-                    "Body contains string %r" % s)
+                    "Body contains string %r" % no_s)
 
     def __str__(self):
         simple_body = '\n'.join([l for l in self.body.splitlines()
@@ -851,6 +1167,62 @@ class TestResponse(Response):
         url = 'file:' + fn.replace(os.sep, '/')
         webbrowser.open_new(url)
 
+class ElementIndex(object):
+
+    """
+    The tags of a response body, found in one pass and shared by
+    ``TestResponse.forms`` and ``Form``, and the elements that
+    ``TestResponse.click()`` searches, found once per tag name.
+
+    ``tags`` is a list of ``(start, end, closing, tag, attr_text)``
+    tuples in the order of the body, with ``tag`` in lower case.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.tags = []
+        self._positions = {}
+        self._elements = {}
+        for match in TestResponse._tag_re.finditer(body):
+            tag = match.group(2).lower()
+            self._positions.setdefault(tag, []).append(len(self.tags))
+            self.tags.append((match.start(), match.end(), match.group(1) == '/',
+                              tag, match.group(3)))
+
+    def positions(self, tag):
+        """
+        The positions in ``tags`` of the start and end tags of
+        ``tag``.
+        """
+        return self._positions.get(tag, [])
+
+    def elements(self, tag):
+        """
+        A list of ``(html, attr_text, content, attrs)`` tuples of
+        the ``tag`` elements that have attributes and an end tag, as
+        found by a search for ``<tag\\s+(.*?)>(.*?)</tag>``.  The
+        ``attrs`` dictionaries are shared, so copy them before
+        changing them.
+        """
+        if tag not in self._elements:
+            self._elements[tag] = [
+                (match.group(0), match.group(1), match.group(2),
+                 _parse_attrs(match.group(1)))
+                for match in _element_re(tag).finditer(self.body)]
+        return self._elements[tag]
+
+_element_res = {}
+
+def _element_re(tag):
+    """
+    The compiled pattern of the ``tag`` elements of
+    ``ElementIndex.elements()``, compiled once per tag name.
+    """
+    if tag not in _element_res:
+        _element_res[tag] = re.compile(r'<%s\s+(.*?)>(.*?)</%s>' % (tag, tag),
+                                       re.I+re.S)
+    return _element_res[tag]
+
 class TestRequest(Request):
 
     # for py.test
@@ -890,9 +1262,19 @@ class Form(object):
 
     _tag_re = re.compile(r'<(/?)([a-z0-9_\-]*)([^>]*?)>', re.I)
 
-    def __init__(self, response, text):
+    def __init__(self, response, text, tags=None):
+        """
+        ``tags`` are the ``(start, end, closing, tag, attr_text)`` of
+        the tags in ``text``, as in ``ElementIndex.tags``; ``text``
+        is searched for them if they are not given.
+        """
         self.response = response
         self.text = text
+        if tags is None:
+            tags = [(match.start(), match.end(), match.group(1) == '/',
+                     match.group(2).lower(), match.group(3))
+                    for match in self._tag_re.finditer(text)]
+        self._tags = tags
         self._parse_fields()
         self._parse_action()
 
@@ -900,26 +1282,24 @@ class Form(object):
         in_select = None
         in_textarea = None
         fields = {}
-        for match in self._tag_re.finditer(self.text):
-            end = match.group(1) == '/'
-            tag = match.group(2).lower()
+        for start, end_pos, end, tag, attr_text in self._tags:
             if tag not in ('input', 'select', 'option', 'textarea',
                            'button'):
                 continue
             if tag == 'select' and end:
                 assert in_select, (
-                    '%r without starting select' % match.group(0))
+                    '%r without starting select' % self.text[start:end_pos])
                 in_select = None
                 continue
             if tag == 'textarea' and end:
                 assert in_textarea, (
-                    "</textarea> with no <textarea> at %s" % match.start())
-                in_textarea[0].value = html_unquote(self.text[in_textarea[1]:match.start()])
+                    "</textarea> with no <textarea> at %s" % start)
+                in_textarea[0].value = html_unquote(self.text[in_textarea[1]:start])
                 in_textarea = None
                 continue
             if end:
                 continue
-            attrs = _parse_attrs(match.group(3))
+            attrs = _parse_attrs(attr_text)
             if 'name' in attrs:
                 name = attrs.pop('name')
             else:
@@ -931,7 +1311,7 @@ class Form(object):
             if tag == 'input' and attrs.get('type') == 'radio':
                 field = fields.get(name)
                 if not field:
-                    field = Radio(self, tag, name, match.start(), **attrs)
+                    field = Radio(self, tag, name, start, **attrs)
                     fields.setdefault(name, []).append(field)
                 else:
                     field = field[0]
@@ -943,30 +1323,28 @@ class Form(object):
             if tag == 'input':
                 tag_type = attrs.get('type', 'text').lower()
             FieldClass = Field.classes.get(tag_type, Field)
-            field = FieldClass(self, tag, name, match.start(), **attrs)
+            field = FieldClass(self, tag, name, start, **attrs)
             if tag == 'textarea':
                 assert not in_textarea, (
                     "Nested textareas: %r and %r"
-                    % (in_textarea, match.group(0)))
-                in_textarea = field, match.end()
+                    % (in_textarea, self.text[start:end_pos]))
+                in_textarea = field, end_pos
             elif tag == 'select':
                 assert not in_select, (
                     "Nested selects: %r and %r"
-                    % (in_select, match.group(0)))
+                    % (in_select, self.text[start:end_pos]))
                 in_select = field
             fields.setdefault(name, []).append(field)
         self.fields = fields
 
     def _parse_action(self):
         self.action = None
-        for match in self._tag_re.finditer(self.text):
-            end = match.group(1) == '/'
-            tag = match.group(2).lower()
+        for start, end_pos, end, tag, attr_text in self._tags:
             if tag != 'form':
                 continue
             if end:
                 break
-            attrs = _parse_attrs(match.group(3))
+            attrs = _parse_attrs(attr_text)
             self.action = attrs.get('action', '')
             self.method = attrs.get('method', 'GET')
             self.id = attrs.get('id')
@@ -0,0 +1,87 @@
+'''
+Tests for the selection of the tests whose code changed since they passed.
+'''
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import time
+import gaeunit
+
+_APP_MODULE = 'gaeunit_change_app_probe'
+_TEST_MODULE = 'gaeunit_change_test_probe'
+_TEST_ID = _TEST_MODULE + '.ProbeTest.test_app'
+
+
+class ChangeTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app_dir = tempfile.mkdtemp()
+        self.test_dir = os.path.join(self.app_dir, 'test')
+        os.mkdir(self.test_dir)
+        self.app_path = self._write(self.app_dir, _APP_MODULE, "def value():\n    return 1\n")
+        self.test_path = self._write(self.test_dir, _TEST_MODULE,
+                                     "import unittest\nfrom %s import value\n\n"
+                                     "class ProbeTest(unittest.TestCase):\n"
+                                     "    def test_app(self):\n"
+                                     "        self.assertEqual(1, value())\n" % _APP_MODULE)
+        sys.path.append(self.app_dir)
+        self.original_dir = os.getcwd()
+        os.chdir(self.app_dir)
+        self.module_cache = gaeunit._TestModuleCache()
+        self.module_cache.load(self.test_dir)
+        self.store = gaeunit._LocalStore(os.path.join(self.app_dir, 'state.json'))
+        self.tracker = gaeunit._ChangeTracker(self.module_cache, self.store)
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        for name in (_APP_MODULE, _TEST_MODULE):
+            sys.modules.pop(name, None)
+        for path in (self.app_dir, self.test_dir):
+            if path in sys.path:
+                sys.path.remove(path)
+        shutil.rmtree(self.app_dir)
+
+    def _write(self, directory, name, content):
+        path = os.path.join(directory, name + '.py')
+        f = open(path, 'w')
+        f.write(content)
+        f.close()
+        return path
+
+    def _touch(self, path, offset):
+        modified = time.time() + offset
+        os.utime(path, (modified, modified))
+
+    def test_dependencies(self):
+        self.assertEqual(sorted([os.path.realpath(self.app_path), os.path.realpath(self.test_path)]),
+                         sorted([os.path.realpath(path) for path in
+                                 self.module_cache.dependencies(_TEST_MODULE)]))
+
+    def test_never_passed_is_changed(self):
+        self.assertTrue(self.tracker.selector()(_TEST_ID))
+
+    def test_passed_is_unchanged(self):
+        self.tracker.record([(_TEST_ID, 'success', 0.1)], time.time() + 1)
+        self.assertFalse(self.tracker.selector()(_TEST_ID))
+
+    def test_changed_dependency(self):
+        self.tracker.record([(_TEST_ID, 'success', 0.1)], time.time() + 1)
+        self._touch(self.app_path, 10)
+        self.assertTrue(self.tracker.selector()(_TEST_ID))
+
+    def test_failed_is_changed(self):
+        self.tracker.record([(_TEST_ID, 'success', 0.1)], time.time() + 1)
+        self.tracker.record([(_TEST_ID, 'failure', 0.1)], time.time() + 1)
+        self.assertTrue(self.tracker.selector()(_TEST_ID))
+
+    def test_store_is_saved(self):
+        self.tracker.record([(_TEST_ID, 'success', 0.1)], 5.0)
+        self.store.save()
+        store = gaeunit._LocalStore(self.store.path)
+        self.assertEqual({_TEST_ID: 5.0}, store.data()['passed'])
+
+
+if __name__ == "__main__":
+    unittest.main()
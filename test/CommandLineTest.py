@@ -0,0 +1,115 @@
+'''
+Tests for the command line runner.
+'''
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import StringIO
+import django.utils.simplejson
+import gaeunit
+import testhelpers
+
+_MODULE_NAME = 'gaeunit_command_line_probe'
+
+_TEST_MODULE = '''
+import unittest
+
+class ProbeTest(unittest.TestCase):
+    def test_one(self):
+        pass
+
+    def test_two(self):
+        pass
+
+    def test_failure(self):
+        self.fail("probe failure")
+'''
+
+
+class CommandLineTest(testhelpers.ApiproxyTestCase):
+
+    def setUp(self):
+        testhelpers.ApiproxyTestCase.setUp(self)
+        self.test_dir = tempfile.mkdtemp()
+        self.original_store_path = gaeunit._local_store.path
+        gaeunit._local_store.move(os.path.join(self.test_dir, 'state.json'))
+        f = open(os.path.join(self.test_dir, _MODULE_NAME + '.py'), 'w')
+        f.write(_TEST_MODULE)
+        f.close()
+
+    def tearDown(self):
+        testhelpers.ApiproxyTestCase.tearDown(self)
+        gaeunit._local_store.move(self.original_store_path)
+        sys.modules.pop(_MODULE_NAME, None)
+        if self.test_dir in sys.path:
+            sys.path.remove(self.test_dir)
+        shutil.rmtree(self.test_dir)
+
+    def _run(self, *args):
+        stream = StringIO.StringIO()
+        args = ['--run', '--dir', self.test_dir, '--app-id', 'probe'] + list(args)
+        code = gaeunit._run_from_command_line(args, stream)
+        return code, stream.getvalue()
+
+    def test_json_output_of_worker_processes(self):
+        code, output = self._run('--processes', '2', '--format', 'json')
+        result = django.utils.simplejson.loads(output)
+        self.assertEqual(1, code)
+        self.assertEqual(3, result['runs'])
+        self.assertEqual(1, len(result['failures']))
+        self.assertEqual(3, len(result['tests']))
+
+    def test_plain_output(self):
+        code, output = self._run('--processes', '1', '%s.ProbeTest.test_one' % _MODULE_NAME)
+        self.assertEqual(0, code)
+        self.assertTrue("Ran 1 test in" in output)
+        self.assertTrue("\nOK\n" in output)
+
+    def test_plain_output_failure(self):
+        code, output = self._run('--processes', '1')
+        self.assertTrue("FAIL: test_failure" in output)
+        self.assertTrue("FAILED (failures=1)" in output)
+
+    def test_unknown_test(self):
+        code, output = self._run('no_such_module_for_gaeunit')
+        self.assertEqual(2, code)
+
+    def test_changed_runs_only_failed_tests_again(self):
+        self._run('--processes', '1')
+        code, output = self._run('--processes', '1', '--changed')
+        self.assertTrue("Ran 1 test in" in output)
+        self.assertTrue("FAIL: test_failure" in output)
+
+    def test_store_option(self):
+        path = os.path.join(self.test_dir, 'other.json')
+        self._run('--processes', '1', '--store', path)
+        self.assertEqual(path, gaeunit._local_store.path)
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, 'state.json')))
+        history = gaeunit._LocalStore(path).data()['history']
+        self.assertEqual(3, len(history))
+
+    def test_schedule_longest_first(self):
+        durations = {'a': 5.0, 'b': 4.0, 'c': 3.0, 'd': 3.0, 'e': 3.0}
+        workers, loads = gaeunit._schedule_longest_first(sorted(durations), durations, 2)
+        self.assertEqual([['a', 'd'], ['b', 'c', 'e']], workers)
+        self.assertEqual([8.0, 10.0], loads)
+        self.assertEqual(([['a']], [5.0]), gaeunit._schedule_longest_first(['a'], durations, 4))
+        self.assertEqual(([], []), gaeunit._schedule_longest_first([], durations, 4))
+
+    def test_schedule_is_reported(self):
+        code, output = self._run('--processes', '2', '--format', 'json')
+        schedule = django.utils.simplejson.loads(output)['schedule']
+        self.assertEqual(2, schedule['workers'])
+        self.assertTrue(schedule['predicted'] > 0)
+
+    def test_unknown_durations_use_median(self):
+        self._run('--processes', '1')
+        durations = gaeunit._estimate_durations(['%s.ProbeTest.test_one' % _MODULE_NAME, 'new.Test.test'])
+        history, default = gaeunit._duration_history()
+        self.assertEqual(default, durations['new.Test.test'])
+        self.assertTrue(default in history.values())
+
+if __name__ == "__main__":
+    unittest.main()
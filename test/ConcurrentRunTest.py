@@ -0,0 +1,59 @@
+'''
+Tests for test runs in concurrent threads, each with its own apiproxy.
+'''
+import unittest
+import threading
+import time
+import gaeunit
+import testhelpers
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import datastore
+
+
+def _sample_tests(kind, seen):
+    class SampleTest(unittest.TestCase):
+        def test_isolated(self):
+            for i in range(5):
+                datastore.Put(datastore.Entity(kind, index=i))
+                time.sleep(0.002)
+            seen.append([len(datastore.Query(k).Get(100)) for k in ('KindA', 'KindB')])
+    return SampleTest
+
+
+class ConcurrentRunTest(testhelpers.ApiproxyTestCase):
+
+    def _run_in_thread(self, kind, seen, results):
+        suite = unittest.defaultTestLoader.loadTestsFromTestCase(_sample_tests(kind, seen))
+        runner = gaeunit.JsonTestRunner()
+        results.append(gaeunit._run_test_suite(runner, suite))
+
+    def test_concurrent_runs_are_isolated(self):
+        seen_a, seen_b, results = [], [], []
+        threads = [threading.Thread(target=self._run_in_thread, args=('KindA', seen_a, results)),
+                   threading.Thread(target=self._run_in_thread, args=('KindB', seen_b, results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([[5, 0]], seen_a)
+        self.assertEqual([[0, 5]], seen_b)
+        for result in results:
+            self.assertEqual(5, result.tests[0]['rpcs']['datastore_v3.Put']['calls'])
+
+    def test_default_apiproxy_outside_runs(self):
+        default = apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+        self._run_in_thread('KindA', [], [])
+        self.assertTrue(apiproxy_stub_map.apiproxy is default)
+
+    def test_apiproxy_replaced_by_a_test_is_restored(self):
+        default = apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+        class ReplacingTest(unittest.TestCase):
+            def test_replace(self):
+                apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+        suite = unittest.defaultTestLoader.loadTestsFromTestCase(ReplacingTest)
+        gaeunit._run_test_suite(gaeunit.JsonTestRunner(), suite)
+        self.assertTrue(apiproxy_stub_map.apiproxy is default)
+
+
+if __name__ == "__main__":
+    unittest.main()
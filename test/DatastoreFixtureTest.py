@@ -0,0 +1,122 @@
+'''
+Tests for the datastore fixtures of GAETestCase.
+'''
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import gaeunit
+import testhelpers
+from google.appengine.api import datastore
+
+
+def _fixture_test_case(scope='class'):
+    class FixtureTestCase(gaeunit.GAETestCase):
+        datastoreFixtureScope = scope
+        builds = []
+
+        def setUpDatastoreFixture(self):
+            self.builds.append(self.id())
+            return datastore.Put(datastore.Entity('Fixture', name='fixture'))
+
+        def test_put(self):
+            datastore.Put(datastore.Entity('Fixture', name='extra'))
+            self._check()
+
+        def test_get(self):
+            self._check()
+
+        def _check(self):
+            self.assertEqual('fixture', datastore.Get(self.datastoreFixture)['name'])
+
+        def test_restored(self):
+            self.assertEqual(1, len(datastore.Query('Fixture').Get(10)))
+    return FixtureTestCase
+
+
+_MODULE_NAME = 'gaeunit_fixture_probe'
+
+_MODULE_SOURCE = """
+import gaeunit
+from google.appengine.api import datastore
+
+class ModuleFixtureTest(gaeunit.GAETestCase):
+    datastoreFixtureScope = 'module'
+
+    def setUpDatastoreFixture(self):
+        return datastore.Put(datastore.Entity('Fixture', name=%r))
+
+    def test_name(self):
+        self.assertEqual(%r, datastore.Get(self.datastoreFixture)['name'])
+"""
+
+
+class DatastoreFixtureTest(testhelpers.PooledDatastoreTestCase):
+
+    def _run(self, test_case):
+        result = unittest.TestResult()
+        suite = unittest.defaultTestLoader.loadTestsFromTestCase(test_case)
+        suite(result)
+        suite(result)
+        self.assertEqual([], result.errors + result.failures)
+        self.assertEqual(6, result.testsRun)
+
+    def test_fixture_built_once_per_class(self):
+        test_case = _fixture_test_case()
+        self._run(test_case)
+        self.assertEqual(1, len(test_case.builds))
+
+    def test_fixture_rebuilt_when_entities_cannot_be_copied(self):
+        original_attributes = gaeunit._DATASTORE_STATE_ATTRIBUTES
+        gaeunit._DATASTORE_STATE_ATTRIBUTES = ('_DatastoreFileStub__entities_by_kind',)
+        try:
+            test_case = _fixture_test_case()
+            self._run(test_case)
+        finally:
+            gaeunit._DATASTORE_STATE_ATTRIBUTES = original_attributes
+        self.assertEqual(6, len(test_case.builds))
+
+    def test_new_class_builds_new_fixture(self):
+        self._run(_fixture_test_case())
+        test_case = _fixture_test_case()
+        self._run(test_case)
+        self.assertEqual(1, len(test_case.builds))
+
+    def test_fixture_error_is_reported(self):
+        class BrokenFixtureTestCase(gaeunit.GAETestCase):
+            def setUpDatastoreFixture(self):
+                raise Exception("broken fixture")
+
+            def test_nothing(self):
+                pass
+        result = unittest.TestResult()
+        BrokenFixtureTestCase('test_nothing').run(result)
+        self.assertEqual(1, len(result.errors))
+
+    def test_reloaded_module_builds_new_fixture(self):
+        test_dir = tempfile.mkdtemp()
+        sys.path.append(test_dir)
+        try:
+            for name in ('before', 'after'):
+                source = open(os.path.join(test_dir, _MODULE_NAME + '.py'), 'w')
+                source.write(_MODULE_SOURCE % (name, name))
+                source.close()
+                for compiled in ('c', 'o'):
+                    if os.path.exists(source.name + compiled):
+                        os.remove(source.name + compiled)
+                if _MODULE_NAME in sys.modules:
+                    module = reload(sys.modules[_MODULE_NAME])
+                else:
+                    module = __import__(_MODULE_NAME)
+                result = unittest.TestResult()
+                unittest.defaultTestLoader.loadTestsFromModule(module)(result)
+                self.assertEqual([], result.errors + result.failures)
+        finally:
+            sys.modules.pop(_MODULE_NAME, None)
+            sys.path.remove(test_dir)
+            shutil.rmtree(test_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
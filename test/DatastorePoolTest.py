@@ -0,0 +1,74 @@
+'''
+Tests for the pool of in-memory datastore stubs.
+'''
+import unittest
+import StringIO
+import gaeunit
+import testhelpers
+from google.appengine.api import datastore
+from google.appengine.api import datastore_errors
+
+
+def _counting_tests():
+    class CountingTest(unittest.TestCase):
+        def test_first(self):
+            datastore.Put(datastore.Entity('Counted'))
+            self.assertEqual(1, len(datastore.Query('Counted').Get(10)))
+
+        def test_second(self):
+            datastore.Put(datastore.Entity('Counted'))
+            self.assertEqual(1, len(datastore.Query('Counted').Get(10)))
+    return unittest.defaultTestLoader.loadTestsFromTestCase(CountingTest)
+
+
+class DatastorePoolTest(testhelpers.ApiproxyTestCase):
+
+    def setUp(self):
+        testhelpers.ApiproxyTestCase.setUp(self)
+        self.pool = gaeunit._DatastoreStubPool()
+        self.use_datastore_stub(self.pool.acquire())
+
+    def test_released_stub_is_reused_empty(self):
+        key = datastore.Put(datastore.Entity('Pooled'))
+        self.pool.release(self.stub)
+        stub = self.pool.acquire()
+        self.assertTrue(stub is self.stub)
+        self.assertRaises(datastore_errors.EntityNotFoundError, datastore.Get, key)
+
+    def test_concurrent_acquire_gets_new_stub(self):
+        self.assertFalse(self.pool.acquire() is self.stub)
+
+    def test_restore_snapshot(self):
+        key = datastore.Put(datastore.Entity('Pooled', name='snapshot'))
+        self.pool.snapshot(self.stub, 'one')
+        datastore.Put(datastore.Entity('Pooled', name='after'))
+        self.pool.restore(self.stub, 'one')
+        self.assertEqual(['snapshot'], [e['name'] for e in datastore.Query('Pooled').Get(10)])
+        self.assertEqual('snapshot', datastore.Get(key)['name'])
+
+    def test_snapshot_of_unknown_stub(self):
+        original_attributes = gaeunit._DATASTORE_STATE_ATTRIBUTES
+        gaeunit._DATASTORE_STATE_ATTRIBUTES = ('_DatastoreFileStub__entities_by_kind',)
+        try:
+            self.assertFalse(self.pool.snapshot(self.stub, 'unknown'))
+        finally:
+            gaeunit._DATASTORE_STATE_ATTRIBUTES = original_attributes
+        self.assertTrue(self.pool.snapshot(self.stub, 'known'))
+
+    def test_acquire_with_snapshot(self):
+        datastore.Put(datastore.Entity('Pooled', name='snapshot'))
+        self.pool.snapshot(self.stub, 'one')
+        self.pool.release(self.stub)
+        self.use_datastore_stub(self.pool.acquire(snapshot='one'))
+        self.assertEqual(1, len(datastore.Query('Pooled').Get(10)))
+
+    def test_each_test_of_a_run_starts_empty(self):
+        result = gaeunit._run_test_suite(gaeunit.JsonTestRunner(), _counting_tests())
+        self.assertEqual((2, 0, 0), (result.testsRun, len(result.errors), len(result.failures)))
+        runner = gaeunit._TimedTextTestRunner(StringIO.StringIO())
+        result = gaeunit._run_test_suite(runner, _counting_tests())
+        self.assertTrue(result.wasSuccessful(), result.failures)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,9 +4,29 @@ Created on May 5, 2009
 @author: george
 '''
 import unittest
+import random
+import re
 import gaeunit
+from xml.sax.saxutils import unescape
 
-class Test(unittest.TestCase):
+
+def _formalize_by_patterns(html):
+    # The regular expressions GAETestCase._formalize used to normalize with.
+    html = html.replace("\r\n", " ").replace("\n", " ")
+    html = re.sub(r"[ \t]+", " ", html)
+    html = re.sub(r"[ ]*>[ ]*", ">", html)
+    html = re.sub(r"[ ]*<[ ]*", "<", html)
+    return unescape(html)
+
+def _random_html(rng, size):
+    parts = [' ', '\t', '\n', '\r', '\r\n', '<', '>', '&lt;', '&gt;', '&amp;', '&', 'a', ';', 'lt']
+    return ''.join([rng.choice(parts) for i in range(size)])
+
+# The seeds of the random HTML, fixed so that every run tests the same HTML.
+_SEEDS = (1, 2, 3)
+
+
+class HtmlTestCaseTest(unittest.TestCase):
     tc = gaeunit.GAETestCase("run")
     
     def test_html_compare_ignorable_blank(self):
@@ -36,6 +56,103 @@ test\r\n"""
         html2 = "< & >"
         self.assertEqual(self.tc._formalize(html1), html2)
         
+    def test_formalize_as_patterns(self):
+        for seed in _SEEDS:
+            rng = random.Random(seed)
+            for i in range(1000):
+                html = _random_html(rng, rng.randint(0, 20))
+                self.assertEqual(_formalize_by_patterns(html), self.tc._formalize(html),
+                                 "seed %d, html %r" % (seed, html))
+
+    def test_chunks_normalize_as_whole(self):
+        original_size = gaeunit._HTML_CHUNK_SIZE
+        gaeunit._HTML_CHUNK_SIZE = 3
+        try:
+            for seed in _SEEDS:
+                rng = random.Random(seed)
+                for i in range(300):
+                    html = _random_html(rng, rng.randint(0, 60))
+                    self.assertEqual(self.tc._formalize(html), gaeunit._NormalizedHtml(html).text(),
+                                     "seed %d, html %r" % (seed, html))
+        finally:
+            gaeunit._HTML_CHUNK_SIZE = original_size
+
+    def test_streams_equal(self):
+        self.assertTrue(gaeunit._html_streams_equal(['ab', '', 'cd'], ['a', 'bcd']))
+        self.assertTrue(gaeunit._html_streams_equal([], ['']))
+        self.assertFalse(gaeunit._html_streams_equal(['ab'], ['abc']))
+        read = []
+        def chunks():
+            for chunk in ['ab', 'x', 'never read']:
+                read.append(chunk)
+                yield chunk
+        self.assertFalse(gaeunit._html_streams_equal(chunks(), ['ab', 'c', 'd']))
+        self.assertEqual(['ab', 'x'], read)
+
+    def test_streams_difference(self):
+        self.assertEqual(None, gaeunit._html_streams_difference(['ab', '', 'cd'], ['a', 'bcd']))
+        self.assertEqual(3, gaeunit._html_streams_difference(['ab', 'cX'], ['a', 'bcd']))
+        self.assertEqual(2, gaeunit._html_streams_difference(['ab'], ['a', 'bc']))
+        self.assertEqual(0, gaeunit._html_streams_difference([], ['a']))
+
+    def test_normalized_slices(self):
+        html = "<div>\n  <p>one &amp; two</p>  <p>three</p>\n</div>  <span> four </span>"
+        original_size = gaeunit._HTML_CHUNK_SIZE
+        gaeunit._HTML_CHUNK_SIZE = 4
+        try:
+            text = self.tc._formalize(html)
+            normalized = gaeunit._NormalizedHtml(html)
+            self.assertEqual(len(text), len(normalized))
+            for start in range(len(text) + 2):
+                for end in range(start, len(text) + 2):
+                    self.assertEqual(text[start:end], normalized[start:end], (start, end))
+        finally:
+            gaeunit._HTML_CHUNK_SIZE = original_size
+
+    def test_difference_window_of_long_html(self):
+        html1 = "<ul>%s</ul>" % "".join(["<li>item %d</li>" % i for i in range(100)])
+        html2 = html1.replace("item 50", "item fifty")
+        original_size = gaeunit._HTML_CHUNK_SIZE
+        gaeunit._HTML_CHUNK_SIZE = 64
+        try:
+            try:
+                self.tc.assertHtmlEqual(html1, html2)
+            except AssertionError, e:
+                window = self.tc._findHtmlDifference(html1, html2)
+                self.assertTrue(str(e).startswith("HTML contents are not equal" + window), str(e))
+            else:
+                self.fail("HTML contents are equal")
+        finally:
+            gaeunit._HTML_CHUNK_SIZE = original_size
+
+    def test_first_difference(self):
+        original_size = gaeunit._HTML_CHUNK_SIZE
+        gaeunit._HTML_CHUNK_SIZE = 4
+        try:
+            self.assertEqual(9, gaeunit._first_difference("abcdefghijk", "abcdefghiXk"))
+            self.assertEqual(0, gaeunit._first_difference("abc", "Xbc"))
+            self.assertEqual(3, gaeunit._first_difference("abc", "abcdefghij"))
+            self.assertEqual(0, gaeunit._first_difference("", "abc"))
+        finally:
+            gaeunit._HTML_CHUNK_SIZE = original_size
+
+    def test_difference_line_and_column(self):
+        html1 = "<div>\n  <p>one &amp; two</p>\n</div>"
+        html2 = "<div>\n<p>one &amp;  three</p></div>"
+        try:
+            self.tc.assertHtmlEqual(html1, html2)
+        except AssertionError, e:
+            self.assertTrue(str(e).endswith(
+                "at line 2, column 17 of the first HTML and line 2, column 16 of the second"), str(e))
+        else:
+            self.fail("HTML contents are equal")
+
+    def test_findHtmlDifference_shorter(self):
+        html1 = "aaaaabbbbbcccccdddddeeeeefffffggggghhhhhiiiii"
+        html2 = html1 + "jjjjj"
+        result_expected = "\n...bcccccdddddeeeeefffffggggghhhhhiiiii     \n...bcccccdddddeeeeefffffggggghhhhhiiiiijjjjj\n%s^" % ("_" * 39)
+        self.assertEqual(result_expected, self.tc._findHtmlDifference(html1, html2))
+
     def test_findHtmlDifference(self):
         html1 = "abcdef"
         html2 = "abccef"
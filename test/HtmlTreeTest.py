@@ -0,0 +1,75 @@
+'''
+Tests for GAETestCase.assertHtmlTreeEqual.
+'''
+import unittest
+import gaeunit
+
+
+class HtmlTreeTest(unittest.TestCase):
+    tc = gaeunit.GAETestCase("run")
+
+    def _difference(self, html1, html2, **options):
+        try:
+            self.tc.assertHtmlTreeEqual(html1, html2, **options)
+        except AssertionError, e:
+            return str(e)
+        return None
+
+    def test_attribute_order_void_elements_and_blanks(self):
+        self.tc.assertHtmlTreeEqual('<p b="2" a="1">one  two\n<br></p>',
+                                    '<p a="1" b="2">\n  one two <br/></p>')
+
+    def test_entities(self):
+        self.tc.assertHtmlTreeEqual('<p>a &amp; &#233; &eacute;</p>', u'<p>a & \xe9 \xe9</p>'.encode('utf-8'))
+
+    def test_first_difference_path(self):
+        message = self._difference('<html><body><div>a</div><div><p class="x">t</p></div></body></html>',
+                                   '<html><body><div>a</div><div>\n<p class="y">t</p></div></body></html>')
+        self.assertEqual('HTML trees are not equal at html/body/div[2]/p\n'
+                         'first:  <p class="x"> at line 1, column 30\n'
+                         'second: <p class="y"> at line 2, column 1', message)
+
+    def test_missing_element(self):
+        message = self._difference('<div><p>a</p></div>', '<div><p>a</p><p>b</p></div>')
+        self.assertTrue(message.startswith('HTML trees are not equal at div/p[2]\n'
+                                           'first:  </div> at line 1, column 14\n'), message)
+
+    def test_text(self):
+        self.assertTrue("text u'b'" in self._difference('<p>a</p>', '<p>b</p>'))
+
+    def test_ignore_attrs(self):
+        self.tc.assertHtmlTreeEqual('<div data-x="1">a</div>', '<div data-x="2">a</div>', ignore_attrs=['data-x'])
+
+    def test_ignore(self):
+        self.tc.assertHtmlTreeEqual('<div><span id="t">1<b>2</b></span><p>x</p></div>',
+                                    '<div><p>x</p><i class="a note">now</i></div>', ignore=['#t', 'i.note'])
+        self.assertRaises(ValueError, self.tc.assertHtmlTreeEqual, '', '', ignore=['div p'])
+
+    def test_ignore_implicitly_closed_elements(self):
+        self.assertTrue(self._difference('<ul><li class=ad>promo<li>item</ul><p>Price: 10</p>',
+                                         '<ul><li class=ad>promo<li>item</ul><p>Price: 99</p>',
+                                         ignore=['li.ad']))
+        self.tc.assertHtmlTreeEqual('<ul><li class=ad>promo<li>item</ul>', '<ul><li>item</li></ul>',
+                                    ignore=['li.ad'])
+        self.tc.assertHtmlTreeEqual('<p class=ad>promo<p>text', '<p>text</p>', ignore=['p.ad'])
+        self.tc.assertHtmlTreeEqual('<table><tr><td class=ad>x<td>y</table>', '<table><tr><td>y</td></tr></table>',
+                                    ignore=['td.ad'])
+        self.assertTrue(self._difference('<div><p class=ad><b>promo</div><p>1</p>',
+                                         '<div></div><p>2</p>', ignore=['p.ad']))
+        self.tc.assertHtmlTreeEqual('<div>a<p class=ad>promo</div><p>b</p>', '<div>a</div><p>b</p>', ignore=['p.ad'])
+
+    def test_implied_end_tags(self):
+        self.tc.assertHtmlTreeEqual('<ul><li>a<li>b</ul><p>c', '<ul><li>a</li><li>b</li></ul><p>c</p>')
+
+    def test_parts(self):
+        original_size = gaeunit._HTML_CHUNK_SIZE
+        gaeunit._HTML_CHUNK_SIZE = 3
+        try:
+            self.tc.assertHtmlTreeEqual('<div class="a">text &amp; more</div>', '<div  class="a" >text & more</div>')
+            self.assertTrue(self._difference('<div><p>text</p></div>', '<div><p>test</p></div>'))
+        finally:
+            gaeunit._HTML_CHUNK_SIZE = original_size
+
+
+if __name__ == "__main__":
+    unittest.main()
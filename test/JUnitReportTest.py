@@ -0,0 +1,76 @@
+'''
+Tests for the streaming JUnit XML report of format=junit.
+'''
+import unittest
+import os
+import shutil
+import tempfile
+from xml.dom import minidom
+import gaeunit
+
+
+def _sample_tests():
+    class SampleTest(unittest.TestCase):
+        set_up_classes = []
+
+        def setUpClass(cls):
+            cls.set_up_classes.append(cls)
+        setUpClass = classmethod(setUpClass)
+
+        def test_pass(self):
+            pass
+
+        def test_fail(self):
+            self.fail("<expected> & \x01 failure")
+
+        def test_error(self):
+            raise ValueError("broken")
+
+    return SampleTest
+
+
+class JUnitReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.original_store_path = gaeunit._local_store.path
+        gaeunit._local_store.path = os.path.join(self.store_dir, 'state.json')
+        self.test_class = _sample_tests()
+        self.suite = unittest.defaultTestLoader.loadTestsFromTestCase(self.test_class)
+
+    def tearDown(self):
+        gaeunit._local_store.path = self.original_store_path
+        shutil.rmtree(self.store_dir)
+
+    def test_one_part_per_test(self):
+        parts = list(gaeunit._junit_report(self.suite))
+        self.assertEqual(5, len(parts))
+        self.assertEqual(gaeunit._JUNIT_HEADER, parts[0])
+        for part in parts[1:4]:
+            self.assertEqual(1, part.count('<testcase '))
+
+    def test_report_is_valid_xml(self):
+        document = minidom.parseString(''.join(gaeunit._junit_report(self.suite)))
+        testcases = document.getElementsByTagName('testcase')
+        self.assertEqual(['test_error', 'test_fail', 'test_pass'],
+                         [testcase.getAttribute('name') for testcase in testcases])
+        failure = testcases[1].getElementsByTagName('failure')[0]
+        self.assertEqual('<expected> & ? failure', failure.getAttribute('message'))
+        error = testcases[0].getElementsByTagName('error')[0]
+        self.assertEqual('ValueError', error.getAttribute('type'))
+        self.assertTrue('raise ValueError' in error.firstChild.data)
+
+    def test_class_fixture_runs_once(self):
+        list(gaeunit._junit_report(self.suite))
+        if hasattr(unittest.TestCase, 'setUpClass'):
+            self.assertEqual(1, len(self.test_class.set_up_classes))
+
+    def test_run_is_recorded(self):
+        list(gaeunit._junit_report(self.suite))
+        failed = gaeunit._run_history.failed()
+        self.assertTrue(self.test_class('test_fail').id() in failed)
+        self.assertFalse(self.test_class('test_pass').id() in failed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,8 +5,9 @@ Created on May 6, 2009
 '''
 import unittest
 import gaeunit
+import testhelpers
 
-class Test(unittest.TestCase):
+class JsonTestResultTest(unittest.TestCase):
     tr = gaeunit.JsonTestResult()
 
     def test_list(self):
@@ -22,6 +23,23 @@ class Test(unittest.TestCase):
         result_expected = [{"desc":"test","detail":"&lt;error&gt;"}]
         result = self.tr._list(list)
         self.assertEqual(result, result_expected) 
+
+    def test_tests_status(self):
+        result = gaeunit.JsonTestResult()
+        unittest.defaultTestLoader.loadTestsFromTestCase(testhelpers.sample_tests())(result)
+        statuses = dict([(t['name'].split('.')[-1], t['status']) for t in result.tests])
+        self.assertEqual({'test_error': 'error', 'test_failure': 'failure',
+                          'test_success': 'success'}, statuses)
+
+    def test_run_without_test_names(self):
+        selection, error = gaeunit._TestSelection.create()
+        suite, error = gaeunit._create_run_suite([], selection, '.')
+        self.assertEqual(None, suite)
+        self.assertTrue(error.startswith("No tests to run"), error)
+
+    def test_split_test_names(self):
+        names = gaeunit._split_test_names(["a.B", ""], "c.D, e.F.g,")
+        self.assertEqual(["a.B", "c.D", "e.F.g"], names)
         
 
 class MockTestCase:
@@ -0,0 +1,99 @@
+'''
+Tests for the file that keeps the test run state between runs.
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import django.utils.simplejson
+import gaeunit
+
+
+class LocalStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.store_dir, 'state.json')
+        self.store = gaeunit._LocalStore(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.store_dir)
+
+    def _lines(self):
+        f = open(self.path)
+        try:
+            return [django.utils.simplejson.loads(line) for line in f.read().splitlines()]
+        finally:
+            f.close()
+
+    def _write(self, content):
+        f = open(self.path, 'w')
+        f.write(content)
+        f.close()
+
+    def test_save_appends_changed_entries(self):
+        for i in range(10):
+            self.store.set('passed', 'm.A.test_%d' % i, 1.0)
+        self.store.save()
+        self.store.set('passed', 'm.A.test_1', 2.0)
+        self.store.remove('passed', 'm.A.test_2')
+        self.store.remove('passed', 'm.A.test_none')
+        self.store.save()
+        lines = self._lines()
+        self.assertEqual(2, len(lines))
+        self.assertEqual({'passed': {'m.A.test_1': 2.0, 'm.A.test_2': None}}, lines[1])
+
+    def test_save_without_changes_writes_nothing(self):
+        self.store.save()
+        self.assertFalse(os.path.exists(self.path))
+        self.store.set('passed', 'm.A.test_1', 1.0)
+        self.store.save()
+        self.store.save()
+        self.assertEqual(1, len(self._lines()))
+
+    def test_journal_is_replayed(self):
+        self.store.set('passed', 'm.A.test_1', 1.0)
+        self.store.set('passed', 'm.A.test_2', 1.0)
+        self.store.set('history', 'm.A.test_1', {'status': 'success', 'time': 0.5, 'when': 1.0})
+        self.store.save()
+        self.store.set('passed', 'm.A.test_1', 2.0)
+        self.store.remove('passed', 'm.A.test_2')
+        self.store.save()
+        store = gaeunit._LocalStore(self.path)
+        self.assertEqual({'passed': {'m.A.test_1': 2.0},
+                          'history': {'m.A.test_1': {'status': 'success', 'time': 0.5,
+                                                     'when': 1.0}}},
+                         store.data())
+
+    def test_long_journal_is_rewritten(self):
+        self.store.set('passed', 'm.A.test_1', 0.0)
+        self.store.save()
+        for i in range(1, gaeunit._STORE_JOURNAL_GROWTH + 1):
+            self.store.set('passed', 'm.A.test_1', float(i))
+            self.store.save()
+        self.assertEqual([{'passed': {'m.A.test_1': float(gaeunit._STORE_JOURNAL_GROWTH)}}],
+                         self._lines())
+
+    def test_unfinished_file_is_rewritten(self):
+        # The single line without newline of older versions, or a save
+        # that did not finish.
+        self._write('{"passed": {"m.A.test_1": 1.0}}\n{"passed": {"m.A.te')
+        self.store.set('passed', 'm.A.test_2', 2.0)
+        self.store.save()
+        self.assertEqual([{'passed': {'m.A.test_1': 1.0, 'm.A.test_2': 2.0}}], self._lines())
+
+    def test_move(self):
+        self.store.set('passed', 'm.A.test_1', 1.0)
+        self.store.save()
+        other_path = os.path.join(self.store_dir, 'other.json')
+        self.store.move(other_path)
+        self.assertEqual({}, self.store.data())
+        self.store.set('passed', 'm.A.test_2', 2.0)
+        self.store.save()
+        self.assertEqual({'passed': {'m.A.test_2': 2.0}},
+                         gaeunit._LocalStore(other_path).data())
+        self.assertEqual({'passed': {'m.A.test_1': 1.0}}, gaeunit._LocalStore(self.path).data())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+'''
+Tests for the test module cache used by _load_default_test_modules.
+'''
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import gaeunit
+
+_MODULE_NAME = 'gaeunit_cache_probe'
+
+
+class ModuleCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.test_dir, _MODULE_NAME + '.py')
+        self._write("VALUE = 1\n")
+        self.cache = gaeunit._TestModuleCache()
+
+    def tearDown(self):
+        sys.modules.pop(_MODULE_NAME, None)
+        if self.test_dir in sys.path:
+            sys.path.remove(self.test_dir)
+        shutil.rmtree(self.test_dir)
+
+    def _write(self, content):
+        f = open(self.path, 'w')
+        f.write(content)
+        f.close()
+        for compiled in (self.path + 'c', self.path + 'o'):
+            if os.path.exists(compiled):
+                os.remove(compiled)
+
+    def test_first_load_imports(self):
+        modules = self.cache.load(self.test_dir)
+        self.assertEqual([_MODULE_NAME], [m.__name__ for m in modules])
+        self.assertEqual(1, self.cache.stats['imported'])
+
+    def test_unchanged_module_is_cached(self):
+        first = self.cache.load(self.test_dir)[0]
+        second = self.cache.load(self.test_dir)[0]
+        self.assertTrue(first is second)
+        self.assertEqual({'imported': 0, 'reloaded': 0, 'cached': 1}, self.cache.stats)
+
+    def test_changed_module_is_reloaded(self):
+        module = self.cache.load(self.test_dir)[0]
+        self._write("VALUE = 22\n")
+        self.cache.load(self.test_dir)
+        self.assertEqual(1, self.cache.stats['reloaded'])
+        self.assertEqual(22, module.VALUE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+'''
+Tests for profiling tests with profile=1.
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import gaeunit
+
+
+def _busy_function():
+    return sum([i * i for i in range(20000)])
+
+
+def _sample_tests():
+    class SampleTest(unittest.TestCase):
+        def test_busy(self):
+            for i in range(5):
+                _busy_function()
+
+    return SampleTest
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dump_dir = tempfile.mkdtemp()
+        self.suite = unittest.defaultTestLoader.loadTestsFromTestCase(_sample_tests())
+
+    def tearDown(self):
+        shutil.rmtree(self.dump_dir)
+
+    def _profile(self, **kwargs):
+        runner = gaeunit.JsonTestRunner(gaeunit._TestProfiler(**kwargs))
+        runner.run(self.suite)
+        return runner.result.as_dict()['tests'][0]['profile']
+
+    def test_hotspots(self):
+        profile = self._profile(top=3)
+        self.assertEqual(3, len(profile['cumulative']))
+        self.assertEqual(3, len(profile['self']))
+        busy = [function for function in profile['cumulative']
+                if function['function'].endswith('(_busy_function)')]
+        self.assertEqual(5, busy[0]['calls'])
+
+    def test_gaeunit_functions_are_left_out(self):
+        profile = self._profile(top=100)
+        for function in profile['cumulative']:
+            self.assertFalse('gaeunit.py' in function['function'], function['function'])
+
+    def test_dump_stats(self):
+        self._profile(dump_dir=os.path.join(self.dump_dir, 'profiles'))
+        self.assertEqual([self.suite._tests[0].id() + '.pstats'],
+                         os.listdir(os.path.join(self.dump_dir, 'profiles')))
+
+    def test_profiler_from_request(self):
+        self.assertEqual((None, None), gaeunit._profiler_from_request({}.get))
+        profiler, error = gaeunit._profiler_from_request({'profile': '1'}.get)
+        self.assertTrue(isinstance(profiler, gaeunit._TestProfiler))
+
+
+if __name__ == "__main__":
+    unittest.main()
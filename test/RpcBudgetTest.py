@@ -0,0 +1,91 @@
+'''
+Tests for the API call assertions of GAETestCase.
+'''
+from __future__ import with_statement
+import unittest
+import gaeunit
+import testhelpers
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import datastore
+
+
+def _put(count):
+    return [datastore.Put(datastore.Entity('Budget', index=i)) for i in range(count)]
+
+
+def _get_each(keys):
+    return [datastore.Get(key) for key in keys]
+
+
+def _sample_tests():
+    class SampleTest(gaeunit.GAETestCase):
+        def test_max_rpcs(self):
+            _put(2)
+            self.assertMaxRPCs('datastore_v3', 2)
+            self.assertMaxRPCs('datastore_v3.Get', 0)
+
+        def test_max_rpcs_exceeded(self):
+            _put(3)
+            self.assertMaxRPCs('datastore_v3.Put', 2)
+
+        def test_budget(self):
+            keys = _put(2)
+            with self.rpcBudget(datastore_v3=2, memcache=0):
+                _get_each(keys)
+
+        def test_budget_exceeded(self):
+            with self.rpcBudget({'datastore_v3.Put': 1}):
+                _put(2)
+
+        def test_query_in_loop(self):
+            keys = _put(3)
+            with self.assertNoQueriesInLoop():
+                _get_each(keys)
+
+        def test_no_query_in_loop(self):
+            keys = _put(3)
+            self.assertNoQueriesInLoop(datastore.Get, keys[0])
+            with self.assertNoQueriesInLoop():
+                datastore.Get(keys[0])
+                datastore.Get(keys[1])
+    return SampleTest
+
+
+class RpcBudgetTest(testhelpers.PooledDatastoreTestCase):
+
+    def _run(self, name):
+        result = unittest.TestResult()
+        _sample_tests()(name).run(result)
+        return result
+
+    def _failure(self, name):
+        result = self._run(name)
+        self.assertEqual([], result.errors)
+        self.assertEqual(1, len(result.failures))
+        return result.failures[0][1]
+
+    def test_within_limits(self):
+        for name in ('test_max_rpcs', 'test_budget', 'test_no_query_in_loop'):
+            result = self._run(name)
+            self.assertTrue(result.wasSuccessful(), (name, result.errors, result.failures))
+
+    def test_max_rpcs_exceeded(self):
+        message = self._failure('test_max_rpcs_exceeded')
+        self.assertTrue("3 datastore_v3.Put calls, more than 2" in message)
+
+    def test_budget_exceeded(self):
+        message = self._failure('test_budget_exceeded')
+        self.assertTrue("2 datastore_v3.Put calls, more than the budget of 1" in message)
+
+    def test_query_in_loop(self):
+        message = self._failure('test_query_in_loop')
+        self.assertTrue("datastore_v3.Get was called 3 times from" in message)
+        self.assertTrue("(in _get_each)" in message)
+
+    def test_stubs_are_restored(self):
+        self._run('test_max_rpcs')
+        self.assertTrue(apiproxy_stub_map.apiproxy.GetStub('datastore_v3') is self.stub)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+'''
+Tests for the recording of the API calls of each test.
+'''
+import unittest
+import StringIO
+import gaeunit
+from google.appengine.api import datastore
+
+
+def _sample_tests():
+    class SampleTest(unittest.TestCase):
+        def test_puts(self):
+            for i in range(3):
+                datastore.Put(datastore.Entity('Sample', index=i))
+            datastore.Query('Sample').Get(10)
+
+        def test_nothing(self):
+            pass
+    return SampleTest
+
+
+class RpcRecorderTest(unittest.TestCase):
+
+    def _run(self, runner):
+        suite = unittest.defaultTestLoader.loadTestsFromTestCase(_sample_tests())
+        return gaeunit._run_test_suite(runner, suite)
+
+    def test_json_result_counts_calls(self):
+        result = self._run(gaeunit.JsonTestRunner())
+        rpcs = dict([(test['name'].split('.')[-1], test['rpcs']) for test in result.tests])
+        self.assertEqual({}, rpcs['test_nothing'])
+        self.assertEqual(3, rpcs['test_puts']['datastore_v3.Put']['calls'])
+        self.assertEqual(1, rpcs['test_puts']['datastore_v3.RunQuery']['calls'])
+        self.assertTrue(rpcs['test_puts']['datastore_v3.Put']['time'] >= 0.0)
+
+    def test_plain_result_lists_calls(self):
+        stream = StringIO.StringIO()
+        self._run(gaeunit._TimedTextTestRunner(stream))
+        self.assertTrue("datastore_v3.Put" in stream.getvalue())
+        self.assertTrue("3 calls" in stream.getvalue())
+
+    def test_nested_recordings(self):
+        recorder = gaeunit._RpcRecorder()
+        recorder.start()
+        recorder.record('memcache', 'Get', 0.5)
+        recorder.start()
+        recorder.record('memcache', 'Get', 0.25)
+        self.assertEqual({'memcache.Get': {'calls': 1, 'time': 0.25}}, recorder.stop())
+        self.assertEqual({'memcache.Get': {'calls': 2, 'time': 0.75}}, recorder.stop())
+
+    def test_wrapped_stub_is_transparent(self):
+        stub = gaeunit._datastore_pool.acquire()
+        try:
+            wrapped = gaeunit._RecordingStub(gaeunit._RecordingStub(stub, gaeunit._rpc_recorder),
+                                             gaeunit._rpc_recorder)
+            self.assertTrue(wrapped._stub is stub)
+            self.assertTrue(wrapped.rpc_recorder is gaeunit._rpc_recorder)
+            gaeunit._datastore_pool.snapshot(wrapped, 'rpc-test')
+            wrapped.Clear()
+        finally:
+            gaeunit._datastore_pool.release(stub)
+
+
+if __name__ == "__main__":
+    unittest.main()
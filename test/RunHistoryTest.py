@@ -0,0 +1,52 @@
+'''
+Tests for the run history and the rerun=failed and order=failed-first options.
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import gaeunit
+
+
+class RunHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.original_history = gaeunit._run_history
+        self.store_dir = tempfile.mkdtemp()
+        store = gaeunit._LocalStore(os.path.join(self.store_dir, 'state.json'))
+        gaeunit._run_history = gaeunit._RunHistory(store)
+        gaeunit._run_history.record([('m.A.test_1', 'success', 0.5),
+                                     ('m.A.test_2', 'failure', 1.5),
+                                     ('m.B.test_3', 'error', 0.1)], 100.0)
+        self.test_ids = ['m.A.test_1', 'm.A.test_2', 'm.B.test_3', 'm.B.test_new']
+
+    def tearDown(self):
+        gaeunit._run_history = self.original_history
+        shutil.rmtree(self.store_dir)
+
+    def test_history(self):
+        self.assertEqual({'status': 'failure', 'time': 1.5, 'when': 100.0},
+                         gaeunit._run_history.tests()['m.A.test_2'])
+
+    def test_later_run_replaces_history(self):
+        gaeunit._run_history.record([('m.A.test_2', 'success', 1.0)], 200.0)
+        self.assertEqual({'m.B.test_3': True}, gaeunit._run_history.failed())
+
+    def test_rerun_failed(self):
+        selection = gaeunit._TestSelection(rerun='failed')
+        self.assertEqual(['m.A.test_2', 'm.B.test_3'], selection.select(self.test_ids))
+
+    def test_failed_first(self):
+        selection = gaeunit._TestSelection(order='failed-first')
+        self.assertEqual(['m.A.test_2', 'm.B.test_3', 'm.A.test_1', 'm.B.test_new'],
+                         selection.select(self.test_ids))
+
+    def test_from_request(self):
+        arguments = {'rerun': 'failed', 'order': 'failed-first'}
+        selection, error = gaeunit._TestSelection.from_request(arguments.get)
+        self.assertTrue(selection.is_active())
+        self.assertFalse(gaeunit._TestSelection.from_request({}.get)[0].is_active())
+
+
+if __name__ == "__main__":
+    unittest.main()
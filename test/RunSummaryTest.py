@@ -0,0 +1,47 @@
+'''
+Tests for the run summaries returned by /test/summary.
+'''
+import unittest
+import gaeunit
+
+
+def _result(times, errors=0, failures=0):
+    return {'runs': len(times),
+            'errors': [{'desc': 'error', 'detail': ''}] * errors,
+            'failures': [{'desc': 'failure', 'detail': ''}] * failures,
+            'tests': [{'time': t} for t in times]}
+
+
+class RunSummaryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.summaries = gaeunit._RunSummaries(size=2)
+
+    def test_totals_of_requests(self):
+        self.summaries.record('a', _result([0.1, 0.2], errors=1), 10.0, 11.0)
+        totals = self.summaries.record('a', _result([0.3], failures=1), 10.5, 12.0)
+        self.assertEqual({'run': 'a', 'requests': 2, 'runs': 3, 'errors': 1, 'failures': 1}, totals)
+        summary = self.summaries.get('a')
+        self.assertEqual(2.0, summary['time'])
+        self.assertEqual(['failure'], [f['desc'] for f in summary['failureDetails']])
+
+    def test_percentiles(self):
+        self.summaries.record('a', _result([i / 100.0 for i in range(100, 0, -1)]), 0.0, 1.0)
+        summary = self.summaries.get('a')
+        self.assertEqual({'50': 0.5, '90': 0.9, '95': 0.95, '99': 0.99}, summary['percentiles'])
+        self.assertEqual(1.0, summary['slowest'])
+
+    def test_oldest_runs_are_dropped(self):
+        for run_id in ('a', 'b', 'c'):
+            self.summaries.record(run_id, _result([0.1]), 0.0, 1.0)
+        self.assertEqual(None, self.summaries.get('a'))
+        self.assertEqual(1, self.summaries.get('c')['runs'])
+
+    def test_unknown_run(self):
+        summary, error = gaeunit._get_run_summary('no-such-run')
+        self.assertEqual(None, summary)
+        self.assertTrue(error)
+
+
+if __name__ == "__main__":
+    unittest.main()
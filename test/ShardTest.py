@@ -0,0 +1,118 @@
+'''
+Tests for splitting the tests into shards with shard=i&shards=n.
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import gaeunit
+
+
+class ShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.original_history = gaeunit._run_history
+        self.store_dir = tempfile.mkdtemp()
+        store = gaeunit._LocalStore(os.path.join(self.store_dir, 'state.json'))
+        gaeunit._run_history = gaeunit._RunHistory(store)
+        self.test_ids = ['m%d.C.test_%d' % (i % 3, i) for i in range(20)]
+
+    def tearDown(self):
+        gaeunit._run_history = self.original_history
+        shutil.rmtree(self.store_dir)
+
+    def _shards(self, count, shard_by='hash', history=None):
+        return [gaeunit._TestSelection(shard=i, shards=count, shard_by=shard_by,
+                                       history=history).select(self.test_ids)
+                for i in range(count)]
+
+    def _history_file(self, outcomes):
+        store = gaeunit._LocalStore(os.path.join(self.store_dir, 'history.json'))
+        gaeunit._RunHistory(store).record(outcomes, 100.0)
+        store.save()
+        return store.path
+
+    def test_shards_partition_the_tests(self):
+        shards = self._shards(3)
+        self.assertEqual(sorted(self.test_ids), sorted(sum(shards, [])))
+        self.assertEqual([7, 7, 6], [len(shard) for shard in shards])
+
+    def test_shards_keep_the_order(self):
+        for shard in self._shards(3):
+            self.assertEqual([test_id for test_id in self.test_ids if test_id in shard], shard)
+
+    def test_shards_do_not_depend_on_the_given_order(self):
+        shards = self._shards(4)
+        self.test_ids.reverse()
+        self.assertEqual([sorted(shard) for shard in shards],
+                         [sorted(shard) for shard in self._shards(4)])
+
+    def test_shards_by_duration(self):
+        history = self._history_file([(test_id, 'success', 0.5) for test_id in self.test_ids] +
+                                     [('m0.C.test_0', 'success', 10.0)])
+        shards = self._shards(2, 'duration', history)
+        self.assertEqual(sorted(self.test_ids), sorted(sum(shards, [])))
+        self.assertEqual([['m0.C.test_0'], 19], [shards[0], len(shards[1])])
+
+    def _shards_with_own_history(self, count, history=None):
+        # Each shard runs in a process that recorded other durations.
+        shards = []
+        for i in range(count):
+            gaeunit._run_history.record([(test_id, 'success', float((j * (i + 1)) % 7))
+                                         for j, test_id in enumerate(self.test_ids)], 100.0)
+            selection = gaeunit._TestSelection(shard=i, shards=count, shard_by='duration',
+                                               history=history)
+            shards.append(selection.select(self.test_ids))
+        return shards
+
+    def test_shards_by_duration_cover_each_test_once(self):
+        history = self._history_file([(test_id, 'success', float(j % 5))
+                                      for j, test_id in enumerate(self.test_ids)])
+        for shards in (self._shards_with_own_history(3, history), self._shards_with_own_history(3)):
+            self.assertEqual(sorted(self.test_ids), sorted(sum(shards, [])))
+
+    def test_shards_by_duration_without_history_are_by_hash(self):
+        self.assertEqual(self._shards(3), self._shards(3, 'duration'))
+
+    def test_more_shards_than_tests(self):
+        self.test_ids = self.test_ids[:2]
+        history = self._history_file([])
+        self.assertEqual(2, len(sum(self._shards(5, 'duration', history), [])))
+        self.assertEqual(2, len(sum(self._shards(5), [])))
+
+    def test_from_request(self):
+        selection, error = gaeunit._TestSelection.from_request({'shard': '1', 'shards': '2'}.get)
+        self.assertEqual((1, 2, None), (selection.shard, selection.shards, error))
+        self.assertTrue(selection.is_active())
+
+    def test_from_request_errors(self):
+        for arguments in ({'shard': '1'}, {'shard': 'a', 'shards': '2'},
+                          {'shard': '2', 'shards': '2'},
+                          {'shard': '0', 'shards': '2', 'shard_by': 'size'},
+                          {'shard': '0', 'shards': '2', 'shard_by': 'duration',
+                           'history': 'missing.json'}):
+            selection, error = gaeunit._TestSelection.from_request(arguments.get)
+            self.assertEqual(None, selection)
+            self.assertTrue(error)
+
+    def test_request_history_is_in_application_directory(self):
+        history = self._history_file([(self.test_ids[0], 'success', 0.5)])
+        original_dir = os.getcwd()
+        os.chdir(self.store_dir)
+        try:
+            arguments = {'shard': '0', 'shards': '2', 'shard_by': 'duration'}
+            for path in (history, os.path.join('..', 'history.json'),
+                         os.path.join('sub', '..', '..', 'history.json')):
+                arguments['history'] = path
+                selection, error = gaeunit._TestSelection.from_request(arguments.get)
+                self.assertEqual(None, selection)
+                self.assertTrue("application directory" in error)
+            arguments['history'] = 'history.json'
+            selection, error = gaeunit._TestSelection.from_request(arguments.get)
+            self.assertEqual(os.path.realpath(history), selection.history)
+        finally:
+            os.chdir(original_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
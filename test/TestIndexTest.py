@@ -0,0 +1,69 @@
+'''
+Tests for the test discovery index behind /test/list and the HTML page.
+'''
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import django.utils.simplejson
+import gaeunit
+
+_MODULE_NAME = 'gaeunit_index_probe'
+
+_TEST_MODULE = '''
+import unittest
+
+class FirstTest(unittest.TestCase):
+    def test_a(self):
+        pass
+
+    def test_b(self):
+        pass
+
+class SecondTest(unittest.TestCase):
+    def test_c(self):
+        pass
+%s
+'''
+
+
+class TestIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.test_dir, _MODULE_NAME + '.py')
+        self._write("")
+        self.index = gaeunit._TestIndex(gaeunit._TestModuleCache())
+
+    def tearDown(self):
+        sys.modules.pop(_MODULE_NAME, None)
+        if self.test_dir in sys.path:
+            sys.path.remove(self.test_dir)
+        shutil.rmtree(self.test_dir)
+
+    def _write(self, extra):
+        f = open(self.path, 'w')
+        f.write(_TEST_MODULE % extra)
+        f.close()
+        if os.path.exists(self.path + 'c'):
+            os.remove(self.path + 'c')
+
+    def test_index(self):
+        expected = {_MODULE_NAME: {'FirstTest': ['test_a', 'test_b'], 'SecondTest': ['test_c']}}
+        self.assertEqual(expected, self.index.tests(self.test_dir))
+        self.assertEqual(expected, django.utils.simplejson.loads(self.index.to_json(self.test_dir)))
+
+    def test_unchanged_json_is_reused(self):
+        first = self.index.to_json(self.test_dir)
+        self.assertTrue(first is self.index.to_json(self.test_dir))
+
+    def test_changed_module_is_listed_again(self):
+        self.index.to_json(self.test_dir)
+        self._write("    def test_d(self):\n        pass\n")
+        tests = django.utils.simplejson.loads(self.index.to_json(self.test_dir))
+        self.assertEqual(['test_c', 'test_d'], tests[_MODULE_NAME]['SecondTest'])
+
+
+if __name__ == "__main__":
+    unittest.main()
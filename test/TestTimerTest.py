@@ -0,0 +1,74 @@
+'''
+Tests for the per-test timing of the JSON and plain text runners.
+'''
+import unittest
+import StringIO
+import gaeunit
+import testhelpers
+
+
+class TestTimerTest(unittest.TestCase):
+
+    def _suite(self):
+        return unittest.defaultTestLoader.loadTestsFromTestCase(testhelpers.sample_tests())
+
+    def test_json_result_timings(self):
+        runner = gaeunit.JsonTestRunner()
+        result = runner.run(self._suite())
+        self.assertEqual(3, len(result.tests))
+        for record in result.tests:
+            for key in ('time', 'setUp', 'test', 'tearDown'):
+                self.assertTrue(record[key] >= 0.0)
+            self.assertTrue(record['time'] >= record['test'])
+        self.assertTrue(result.timeTaken >= 0.0)
+
+    def test_timer_restores_test_methods(self):
+        test = testhelpers.sample_tests()('test_success')
+        timer = gaeunit._TestTimer()
+        timer.start(test)
+        self.assertTrue('setUp' in test.__dict__)
+        timer.stop(test)
+        self.assertEqual({}, dict([(k, v) for k, v in test.__dict__.items()
+                                   if k in ('setUp', 'tearDown', 'test_success')]))
+
+    def test_tracebacks_have_no_timer_frames(self):
+        result = gaeunit.JsonTestRunner().run(self._suite())
+        traceback = result.failures[0][1]
+        self.assertTrue('in test_failure' in traceback, traceback)
+        self.assertFalse('gaeunit.py' in traceback, traceback)
+
+    def test_plain_runner_lists_slowest_tests(self):
+        stream = StringIO.StringIO()
+        gaeunit._TimedTextTestRunner(stream).run(self._suite())
+        output = stream.getvalue()
+        self.assertTrue("Slowest 3 tests:" in output)
+        self.assertTrue("SampleTest.test_failure" in output.split("Slowest")[1])
+
+    def test_plain_runner_slowest_count(self):
+        for slowest, listed in ((1, 1), (0, 3), (5, 3)):
+            stream = StringIO.StringIO()
+            gaeunit._TimedTextTestRunner(stream, slowest=slowest).run(self._suite())
+            self.assertTrue("Slowest %d tests:" % listed in stream.getvalue())
+
+    def test_slowest_from_request(self):
+        for value, expected in ((None, (10, None)), ('', (10, None)), ('0', (0, None)),
+                                ('25', (25, None))):
+            self.assertEqual(expected, gaeunit._slowest_from_request({'slowest': value}.get))
+        for value in ('-1', 'all'):
+            slowest, error = gaeunit._slowest_from_request({'slowest': value}.get)
+            self.assertEqual(None, slowest)
+            self.assertTrue("'slowest'" in error)
+
+    def test_plain_results_slowest_count(self):
+        result = {'tests': [{'name': 'test_%d' % i, 'status': 'success', 'time': i * 0.1,
+                             'setUp': 0.0, 'test': i * 0.1, 'tearDown': 0.0, 'rpcs': {}}
+                            for i in range(12)],
+                  'runs': 12, 'errors': [], 'failures': [], 'time': 1.0}
+        for slowest, listed in ((gaeunit._SLOWEST_TESTS_COUNT, 10), (0, 12), (2, 2)):
+            stream = StringIO.StringIO()
+            gaeunit._write_plain_results(stream, result, slowest)
+            self.assertTrue("Slowest %d tests:" % listed in stream.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
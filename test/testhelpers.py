@@ -0,0 +1,54 @@
+'''
+Helpers shared by the tests of gaeunit.
+
+The sample tests that the tests run are classes returned by functions, so
+that test discovery, and gaeunit when it loads the test directory, do not
+run them on their own.
+'''
+import unittest
+import gaeunit
+from google.appengine.api import apiproxy_stub_map
+
+
+def sample_tests():
+    class SampleTest(unittest.TestCase):
+        def setUp(self):
+            pass
+
+        def test_success(self):
+            pass
+
+        def test_failure(self):
+            self.fail()
+
+        def test_error(self):
+            raise Exception()
+    return SampleTest
+
+
+class ApiproxyTestCase(unittest.TestCase):
+    """Puts apiproxy_stub_map.apiproxy back after each test."""
+
+    def setUp(self):
+        self.original_apiproxy = apiproxy_stub_map.apiproxy
+
+    def tearDown(self):
+        apiproxy_stub_map.apiproxy = self.original_apiproxy
+
+    def use_datastore_stub(self, stub):
+        """Make the datastore calls of the test with stub."""
+        self.stub = stub
+        apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+        apiproxy_stub_map.apiproxy.RegisterStub('datastore_v3', stub)
+
+
+class PooledDatastoreTestCase(ApiproxyTestCase):
+    """Makes the datastore calls of each test with a stub of gaeunit's pool."""
+
+    def setUp(self):
+        ApiproxyTestCase.setUp(self)
+        self.use_datastore_stub(gaeunit._datastore_pool.acquire())
+
+    def tearDown(self):
+        ApiproxyTestCase.tearDown(self)
+        gaeunit._datastore_pool.release(self.stub)